@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""比较微博正文解析前后的速度
+
+fixtures/bodies.jsonl中每行是一条按m.weibo.cn接口格式手工整理的微博正文，
+包含表情、话题、@用户、位置、头条文章、视频链接和转发链。先检查
+extract_body与原来逐项XPath的解析结果一致，再把语料重复count次测试
+每秒解析的微博数，如 python benchmarks/body_bench.py 500
+"""
+
+import codecs
+import json
+import os
+import sys
+import time
+
+from lxml import etree
+
+BENCH_DIR = os.path.split(os.path.realpath(__file__))[0]
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from extractor import extract_body  # noqa: E402
+
+CORPUS_PATH = os.path.join(BENCH_DIR, 'fixtures', 'bodies.jsonl')
+LOCATION_ICON = 'timeline_card_small_location_default.png'
+
+
+def load_corpus():
+    with codecs.open(CORPUS_PATH, encoding='utf-8') as f:
+        return [json.loads(line)['text'] for line in f if line.strip()]
+
+
+def xpath_body(text_body):
+    """原来parse_weibo的解析方式：建两次树，每一项各做一次全文XPath"""
+    selector = etree.HTML(text_body)
+    text = etree.HTML(text_body).xpath('string(.)')
+    article_url = ''
+    if selector.xpath('string(.)').startswith(u'发布了头条文章'):
+        url = selector.xpath('//a/@data-url')
+        if url and url[0].startswith('http://t.cn'):
+            article_url = url[0]
+    span_list = selector.xpath('//span')
+    location = ''
+    for i, span in enumerate(span_list):
+        if span.xpath('img/@src'):
+            if LOCATION_ICON in span.xpath('img/@src')[0]:
+                location = span_list[i + 1].xpath('string(.)')
+                break
+    topic_list = []
+    for span in selector.xpath("//span[@class='surl-text']"):
+        topic = span.xpath('string(.)')
+        if len(topic) > 2 and topic[0] == '#' and topic[-1] == '#':
+            topic_list.append(topic[1:-1])
+    at_list = []
+    for a in selector.xpath('//a'):
+        if '@' + a.xpath('@href')[0][3:] == a.xpath('string(.)'):
+            at_list.append(a.xpath('string(.)')[1:])
+    return text, article_url, location, ','.join(topic_list), ','.join(
+        at_list)
+
+
+def check(corpus):
+    """两种解析方式结果不一致时抛出AssertionError"""
+    for i, text_body in enumerate(corpus):
+        expected = xpath_body(text_body)
+        assert extract_body(text_body) == expected, (i, expected)
+    print(u'%d条正文解析结果一致' % len(corpus))
+
+
+def benchmark(count=500):
+    corpus = load_corpus()
+    check(corpus)
+    bodies = corpus * count
+    for label, parse in ((u'逐项XPath', xpath_body), (u'单次遍历', extract_body)):
+        start = time.time()
+        for text_body in bodies:
+            parse(text_body)
+        elapsed = time.time() - start
+        print(u'%s：%d条微博，用时%.2f秒，每秒%d条' %
+              (label, len(bodies), elapsed, len(bodies) / elapsed))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(arg) for arg in sys.argv[1:]])
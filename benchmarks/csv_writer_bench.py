@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试CsvWriter在超长时间线上的写入速度，文件写在临时目录中，测试完删除
+
+python benchmarks/csv_writer_bench.py 1000000
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.split(os.path.realpath(__file__))[0]
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from csv_writer import CsvWriter  # noqa: E402
+from records import CSV_FIELDS  # noqa: E402
+
+
+def benchmark(rows=1000000, batch=200):
+    """在合成的超长时间线上测试首次写入和重复运行时的写入速度"""
+    headers = list(CSV_FIELDS)
+    temp_dir = tempfile.mkdtemp()
+    path = os.path.join(temp_dir, 'csv_writer_benchmark.csv')
+    weibo = {k: u'微博正文' * 10 for k in CSV_FIELDS}
+    weibo_list = []
+    for i in range(batch):
+        w = dict(weibo)
+        w['id'] = i
+        weibo_list.append(w)
+    for label in (u'首次写入', u'重复运行'):
+        start = time.time()
+        writer = CsvWriter(path, headers, filter=1)
+        written = 0
+        for offset in range(0, rows, batch):
+            for i, w in enumerate(weibo_list):
+                w['id'] = offset + i
+            written += writer.write(weibo_list)
+        writer.close()
+        print(u'%s：%d行，新写入%d行，用时%.2f秒，文件%.1fMB' %
+              (label, rows, written, time.time() - start,
+               os.path.getsize(path) / 1048576.0))
+    shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    benchmark(*[int(arg) for arg in sys.argv[1:]])
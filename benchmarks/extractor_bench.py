@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""检查并测试extractor.extract_status
+
+fixtures/detail中是按m.weibo.cn详情页结构手工整理的页面，包含字符串中的
+花括号、转义引号、反斜杠、\\u转义和多字节字符。检查时把每个页面按不同大小
+切块喂入，包括每个字节单独一块和在每个位置切成两块，结果必须与原来整页
+截取的解析方式一致；无法解析的页面必须抛出预期的异常。
+
+python benchmarks/extractor_bench.py 2000
+"""
+
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.split(os.path.realpath(__file__))[0]
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from extractor import (LayoutChanged, PageNotReady, VisitorPage,  # noqa: E402
+                       extract_status)
+
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures', 'detail')
+# 页面文件名到预期异常，None表示应能解析出status
+EXPECTED = {
+    'long_weibo.html': None,
+    'malformed.html': LayoutChanged,
+    'retweet.html': None,
+    'truncated.html': PageNotReady,
+    'no_status.html': LayoutChanged,
+    'visitor.html': VisitorPage,
+}
+CHUNK_SIZES = (1, 2, 3, 7, 64, 1024, 16 * 1024)
+
+
+def load_fixtures():
+    fixtures = {}
+    for name in sorted(EXPECTED):
+        with open(os.path.join(FIXTURE_DIR, name), 'rb') as f:
+            fixtures[name] = f.read()
+    return fixtures
+
+
+def reference_status(data):
+    """原来的解析方式：整页解码后截取"status":到"hotScheme"之间的内容"""
+    html = data.decode('utf-8')
+    html = html[html.find('"status":'):]
+    html = html[:html.rfind('"hotScheme"')]
+    html = html[:html.rfind(',')]
+    return json.loads('{' + html + '}', strict=False)['status']
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def bytes_read(data, size):
+    """按size切块提取时实际读取的字节数"""
+    read = [0]
+
+    def chunks():
+        for chunk in split(data, size):
+            read[0] += len(chunk)
+            yield chunk
+
+    extract_status(chunks())
+    return read[0]
+
+
+def extract_error(chunks):
+    try:
+        extract_status(chunks)
+    except (PageNotReady, LayoutChanged, VisitorPage) as e:
+        return type(e)
+
+
+def check():
+    """检查所有页面，不一致时抛出AssertionError"""
+    for name, data in load_fixtures().items():
+        expected = EXPECTED[name]
+        if expected is None:
+            status = reference_status(data)
+            for size in CHUNK_SIZES:
+                assert extract_status(split(data, size)) == status, (name,
+                                                                     size)
+            for i in range(len(data) + 1):
+                assert extract_status([data[:i], data[i:]]) == status, (name,
+                                                                        i)
+            print(u'%s：通过，按1KB分块读取了%d/%d字节' %
+                  (name, bytes_read(data, 1024), len(data)))
+        else:
+            for size in CHUNK_SIZES:
+                error = extract_error(split(data, size))
+                assert error is expected, (name, size, error)
+            print(u'%s：通过' % name)
+
+
+def benchmark(count=2000):
+    """比较增量提取和原来整页截取的解析速度，每块16KB，与get_long_weibo相同"""
+    pages = [
+        data for name, data in load_fixtures().items()
+        if EXPECTED[name] is None
+    ]
+    chunked = [split(data, 16 * 1024) for data in pages]
+    for label, parse, inputs in ((u'整页截取', reference_status, pages),
+                                 (u'增量提取', extract_status, chunked)):
+        start = time.time()
+        for _ in range(count):
+            for item in inputs:
+                parse(item)
+        elapsed = time.time() - start
+        print(u'%s：%d个页面，用时%.3f秒，每秒%d页' %
+              (label, count * len(inputs), elapsed,
+               count * len(inputs) / elapsed))
+
+
+if __name__ == '__main__':
+    check()
+    benchmark(*[int(arg) for arg in sys.argv[1:]])
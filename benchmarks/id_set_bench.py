@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试get_one_page中每条微博去重(查询+加入)的耗时是否随时间线变长而保持不变
+
+依次比较原来的list、IdSet和IdSet(compact=True)，时间线越长list越慢，
+两种IdSet每条微博的耗时应基本不变，如
+python benchmarks/id_set_bench.py 1000000
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.split(os.path.realpath(__file__))[0]
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from post_index import IdSet  # noqa: E402
+
+SAMPLE = 1000  # 每个长度处计时的微博数
+LIST_LIMIT = 100000  # list超过该长度后太慢，不再测试
+
+
+def timeline_ids(count):
+    """按时间线从新到旧的顺序生成微博id"""
+    return [4600000000000000 - i * 97 for i in range(count)]
+
+
+def per_post(seen, ids, start):
+    """已有start条微博时，再处理SAMPLE条微博的平均耗时，单位为微秒"""
+    begin = time.perf_counter()
+    add = seen.append if isinstance(seen, list) else seen.add
+    for weibo_id in ids[start:start + SAMPLE]:
+        if weibo_id not in seen:
+            add(weibo_id)
+    return (time.perf_counter() - begin) / SAMPLE * 1e6
+
+
+def benchmark(count=1000000):
+    ids = timeline_ids(count + SAMPLE)
+    sizes = [size for size in (10**4, 10**5, 10**6, 10**7)
+             if size <= count]
+    for label, make in ((u'list', list), (u'IdSet', IdSet),
+                        (u'IdSet(compact)', lambda: IdSet(compact=True))):
+        seen = make()
+        results = []
+        for size in sizes:
+            if isinstance(seen, list) and size > LIST_LIMIT:
+                break
+            if isinstance(seen, list):
+                seen.extend(ids[len(seen):size])
+            else:
+                seen.update(ids[len(seen):size])
+            results.append(u'%d条时%.2f微秒' % (size, per_post(seen, ids, size)))
+        length = len(seen)
+        del seen
+        tracemalloc.start()  # 计时时不开启tracemalloc，以免影响结果
+        seen = make()
+        if isinstance(seen, list):
+            seen.extend(ids[:length])
+        else:
+            seen.update(ids[:length])
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del seen
+        print(u'%s：每条微博%s；%d个id占用%.1fMB' %
+              (label, u'，'.join(results), length, memory / 1048576.0))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""比较一批微博交给各写入方式前的准备开销，以及整条时间线占用的内存
+
+python benchmarks/records_bench.py 10000
+python benchmarks/records_bench.py memory 200000
+"""
+
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+BENCH_DIR = os.path.split(os.path.realpath(__file__))[0]
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from normalize import WEIBO_SCHEMA  # noqa: E402
+from records import (WeiboRecord, csv_row, document,  # noqa: E402
+                     dynamo_weibo_attributes, mysql_weibo_rows)
+
+
+def synthetic_batch(count, record=OrderedDict):
+    """合成的时间线，一半为转发微博，record为每条微博使用的类型"""
+    batch = []
+    for i in range(count):
+        w = record()
+        for k in WEIBO_SCHEMA:
+            w[k] = u'微博正文%d' % i
+        w['id'] = i
+        for k in ('attitudes_count', 'comments_count', 'reposts_count'):
+            w[k] = i
+        if i % 2:
+            retweet = copy.copy(w)
+            retweet['id'] = 10**9 + i
+            w['retweet'] = retweet
+        batch.append(w)
+    return tuple(batch)
+
+
+def old_flush(batch, filter=0):
+    """原来的写入方式：get_write_info生成OrderedDict，三个数据库各深拷贝一次"""
+    for w in batch:  # csv
+        wb = OrderedDict()
+        for k, v in w.items():
+            if k not in ['user_id', 'screen_name', 'retweet']:
+                wb[k] = v
+        if not filter and w.get('retweet'):
+            for k2, v2 in w['retweet'].items():
+                wb['retweet_' + k2] = v2
+    json.dumps(list(batch), ensure_ascii=False)  # json
+    info_list = copy.deepcopy(list(batch))  # mysql
+    for w in info_list:
+        if 'retweet' in w:
+            w['retweet']['retweet_id'] = ''
+            w['retweet_id'] = w['retweet']['id']
+            del w['retweet']
+        else:
+            w['retweet_id'] = ''
+        tuple(w.values())
+    for info in copy.deepcopy(list(batch)):  # mongo
+        info['_id'] = info['id']
+    for info in copy.deepcopy(list(batch)):  # dynamo
+        dict(info)
+
+
+def new_flush(batch, filter=0):
+    for w in batch:
+        csv_row(w, filter)
+    json.dumps([document(w) for w in batch], ensure_ascii=False)
+    for w in batch:
+        mysql_weibo_rows(w)
+    for w in batch:
+        document(w)
+    for w in batch:
+        dynamo_weibo_attributes(w)
+
+
+def benchmark(count=10000):
+    """比较csv、json、mysql、mongo、dynamo五种写入方式每批的准备时间和峰值内存，
+    不含实际写入
+    """
+    for label, flush, record in ((u'深拷贝', old_flush, OrderedDict),
+                                 (u'投影', new_flush, WeiboRecord)):
+        batch = synthetic_batch(count, record)
+        start = time.time()
+        flush(batch)
+        elapsed = time.time() - start
+        tracemalloc.start()
+        flush(batch)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(u'%s：%d条微博×5种写入方式，用时%.3f秒，峰值内存%.1fMB' %
+              (label, count, elapsed, peak / 1048576.0))
+
+
+def memory_benchmark(count=200000):
+    """比较整条时间线以OrderedDict、dict和WeiboRecord保存时占用的内存"""
+    for record in (OrderedDict, dict, WeiboRecord):
+        tracemalloc.start()
+        batch = synthetic_batch(count, record)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del batch
+        print(u'%s：%d条微博，共%.1fMB，平均每条%d字节' %
+              (record.__name__, count, size / 1048576.0, size // count))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['memory']:
+        memory_benchmark(*[int(arg) for arg in sys.argv[2:]])
+    else:
+        benchmark(*[int(arg) for arg in sys.argv[1:]])
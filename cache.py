@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class WeiboCache(object):
+    """以微博id为键的已解析微博缓存
+
+    内存中按LRU保留最近使用的capacity条，同时保存在sqlite文件中供以后运行使用，
+    超过ttl秒的缓存视为失效。缓存以json字符串保存，每次读取都返回新的对象，
+    调用者修改返回值不会影响缓存
+    """
+    def __init__(self, path, capacity=10000, ttl=86400):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute("""CREATE TABLE IF NOT EXISTS weibo (
+                        id TEXT PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        updated REAL NOT NULL)""")
+        self.db.execute('DELETE FROM weibo WHERE updated < ?',
+                        (time.time() - ttl, ))
+        self.db.commit()
+
+    def remember(self, key, data, updated):
+        self.memory[key] = (data, updated)
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def get(self, weibo_id):
+        """获取未过期的缓存微博，没有时返回None"""
+        key = str(weibo_id)
+        expired = time.time() - self.ttl
+        with self.lock:
+            item = self.memory.get(key)
+            if item is None:
+                item = self.db.execute(
+                    'SELECT data, updated FROM weibo WHERE id = ?',
+                    (key, )).fetchone()
+                if item is None:
+                    return None
+            if item[1] < expired:
+                self.memory.pop(key, None)
+                return None
+            self.remember(key, item[0], item[1])
+        return json.loads(item[0], object_pairs_hook=OrderedDict)
+
+    def set(self, weibo_id, weibo):
+        key = str(weibo_id)
+        data = json.dumps(weibo, ensure_ascii=False)
+        updated = time.time()
+        with self.lock:
+            self.remember(key, data, updated)
+            self.db.execute(
+                'INSERT OR REPLACE INTO weibo (id, data, updated) '
+                'VALUES (?, ?, ?)', (key, data, updated))
+            self.db.commit()
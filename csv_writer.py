@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import csv
+import io
+import os
+
+from post_index import IdSet
+from records import csv_row
+
+BUFFER_SIZE = 1 << 20
+
+
+class CsvWriter(object):
+    """在一个用户的整个爬取过程中保持打开的csv结果文件
+
+    每批微博直接由记录生成行，整批编码后一次写入文件。同目录的.ids文件
+    记录已写入的微博id，再次运行时只追加新微博；文件只追加，每批写入后
+    追加一行"#csv文件大小"，大小对不上时说明csv被改动过，从csv重建。
+    一批写入出错时截掉这批已写入的部分，id也不记为已写入，重试时整批重写。
+    update为True时，已写入微博的新版本先暂存，close时一次性替换文件中的旧行
+    """
+    def __init__(self, path, headers, filter=0, update=False):
+        self.path = path
+        self.ids_path = path + '.ids'
+        self.headers = headers
+        self.filter = filter
+        self.update = update
+        self.updates = {}  # 微博id(str)到新版本的行
+        self.ids = IdSet(compact=True)
+        self.load_ids()
+        is_first_write = not os.path.isfile(path) or not os.path.getsize(path)
+        # 不使用缓冲，出错时截断文件不会留下缓冲区中的残余数据
+        self.file = open(path, 'ab', buffering=0)
+        self.ids_file = codecs.open(self.ids_path, 'a', encoding='utf-8')
+        if is_first_write:  # 只在文件开头写BOM
+            self.write_bytes(codecs.BOM_UTF8 + self.encode([headers]))
+
+    def load_ids(self):
+        size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        ids = []
+        checked_size = 0
+        if os.path.isfile(self.ids_path):
+            with codecs.open(self.ids_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line[0] == '#':
+                        checked_size = int(line[1:])
+                    elif line.rstrip('\n').isdigit():
+                        ids.append(int(line))
+        if checked_size != size:
+            ids = self.read_csv_ids() if size else []
+            with codecs.open(self.ids_path, 'w', encoding='utf-8') as f:
+                f.writelines([u'%d\n' % i for i in ids])
+                f.write(u'#%d\n' % size)
+        self.ids.update(ids)
+
+    def read_csv_ids(self):
+        ids = []
+        with open(self.path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.reader(f):
+                if row and row[0].isdigit():
+                    ids.append(int(row[0]))
+        return ids
+
+    def encode(self, rows):
+        text = io.StringIO()
+        csv.writer(text).writerows(rows)
+        return text.getvalue().encode('utf-8')
+
+    def write_bytes(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self.file.write(view):]
+
+    def write(self, weibo_list):
+        """写入一批微博，返回新写入的微博数"""
+        rows = []
+        lines = []
+        new_ids = set()
+        for w in weibo_list:
+            if w['id'] in self.ids or w['id'] in new_ids:
+                if self.update:
+                    self.updates[str(w['id'])] = csv_row(w, self.filter)
+                continue
+            new_ids.add(w['id'])
+            rows.append(csv_row(w, self.filter))
+            lines.append(u'%d\n' % w['id'])
+        if rows:
+            data = self.encode(rows)
+            size = os.fstat(self.file.fileno()).st_size
+            try:
+                self.write_bytes(data)
+                # 先写csv再记录id，中断时大小对不上，下次从csv重建
+                lines.append(u'#%d\n' % (size + len(data)))
+                self.ids_file.writelines(lines)
+                self.ids_file.flush()
+            except Exception:
+                os.ftruncate(self.file.fileno(), size)
+                raise
+            self.ids.update(new_ids)
+        return len(rows)
+
+    def close(self):
+        self.file.close()
+        if self.updates:
+            self.apply_updates()
+        self.ids_file.close()
+
+    def apply_updates(self):
+        """用暂存的新版本替换csv中的旧行，整个文件只重写一次"""
+        temp_path = self.path + '.part'
+        with open(self.path, encoding='utf-8-sig', newline='') as f, open(
+                temp_path,
+                'w',
+                encoding='utf-8-sig',
+                newline='',
+                buffering=BUFFER_SIZE) as temp:
+            writer = csv.writer(temp)
+            for row in csv.reader(f):
+                if row:
+                    row = self.updates.get(row[0], row)
+                writer.writerow(row)
+        os.replace(temp_path, self.path)
+        self.ids_file.write(u'#%d\n' % os.path.getsize(self.path))
+        self.updates = {}
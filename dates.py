@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # 微博发布时间的保存格式，可以直接按字符串比较先后
+START_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'  # 写入用户配置txt文件的时间，不能包含空格
+SINCE_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
+                      '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M')
+MONTHS = {
+    'Jan': 1,
+    'Feb': 2,
+    'Mar': 3,
+    'Apr': 4,
+    'May': 5,
+    'Jun': 6,
+    'Jul': 7,
+    'Aug': 8,
+    'Sep': 9,
+    'Oct': 10,
+    'Nov': 11,
+    'Dec': 12,
+}
+BEIJING_OFFSET = 8 * 60  # 微博时间统一转换为北京时间，单位为分钟
+
+
+def beijing_now():
+    """当前的北京时间，不依赖运行爬虫的机器所在时区"""
+    return datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(
+        minutes=BEIJING_OFFSET)
+
+
+def format_date(value):
+    return '%04d-%02d-%02d' % (value.year, value.month, value.day)
+
+
+def format_datetime(value):
+    return '%04d-%02d-%02d %02d:%02d:%02d' % (value.year, value.month,
+                                              value.day, value.hour,
+                                              value.minute, value.second)
+
+
+def parse_clock(text):
+    """解析HH:MM或HH:MM:SS，返回(时, 分, 秒)"""
+    parts = text.split(':')
+    if len(parts) == 2:
+        return int(parts[0]), int(parts[1]), 0
+    if len(parts) == 3:
+        return int(parts[0]), int(parts[1]), int(parts[2])
+    raise ValueError(u'无法识别的时间：%s' % text)
+
+
+@lru_cache(maxsize=4096)
+def parse_absolute(created_at):
+    """解析不依赖当前时间的发布时间，如Sat Oct 17 12:00:00 +0800 2020和2020-10-17"""
+    parts = created_at.split()
+    if len(parts) == 6:  # 接口返回的完整时间
+        hour, minute, second = parse_clock(parts[3])
+        value = datetime(int(parts[5]), MONTHS[parts[1]], int(parts[2]),
+                         hour, minute, second)
+        zone = parts[4]
+        if zone != '+0800':
+            offset = int(zone[1:3]) * 60 + int(zone[3:5])
+            if zone[0] == '-':
+                offset = -offset
+            value += timedelta(minutes=BEIJING_OFFSET - offset)
+        return format_datetime(value)
+    if len(parts) <= 2:
+        fields = parts[0].split('-')
+        if len(fields) == 3:  # yyyy-mm-dd，可能带有HH:MM
+            value = datetime(int(fields[0]), int(fields[1]), int(fields[2]))
+            if len(parts) == 1:  # 只精确到天
+                return format_date(value)
+            hour, minute, second = parse_clock(parts[1])
+            return format_datetime(
+                value.replace(hour=hour, minute=minute, second=second))
+    raise ValueError(u'无法识别的发布时间：%s' % created_at)
+
+
+def standardize_date(created_at, now=None):
+    """把微博发布时间标准化为yyyy-mm-dd HH:MM:SS形式，只精确到天的时间为yyyy-mm-dd
+
+    绝对时间的解析结果会被缓存；刚刚、N分钟前、N小时前、昨天、今天和mm-dd
+    这些相对时间依赖当前时间，每次根据now(北京时间)重新计算
+    """
+    if now is None:
+        now = beijing_now()
+    if created_at == u'刚刚':
+        return format_datetime(now)
+    if created_at.endswith(u'分钟前'):
+        return format_datetime(now - timedelta(minutes=int(created_at[:-3])))
+    if created_at.endswith(u'小时前'):
+        return format_datetime(now - timedelta(hours=int(created_at[:-3])))
+    if created_at.startswith(u'昨天') or created_at.startswith(u'今天'):
+        day = now - timedelta(days=1) if created_at[0] == u'昨' else now
+        clock = created_at[2:].strip()
+        if not clock:
+            return format_date(day)
+        hour, minute, second = parse_clock(clock)
+        return format_datetime(
+            day.replace(hour=hour, minute=minute, second=second))
+    if len(created_at) == 5 and created_at[2] == '-':  # 今年的mm-dd
+        value = datetime(now.year, int(created_at[:2]), int(created_at[3:]))
+        if value > now:
+            value = value.replace(year=now.year - 1)
+        return format_date(value)
+    return parse_absolute(created_at)
+
+
+def is_before(created_at, since_cutoff):
+    """发布时间是否早于起始时间，只精确到天的发布时间按天比较"""
+    return created_at < since_cutoff[:len(created_at)]
+
+
+def parse_since_date(since_date):
+    """把since_date转换为与发布时间同格式的字符串，格式不正确时返回None"""
+    for date_format in SINCE_DATE_FORMATS:
+        try:
+            return format_datetime(datetime.strptime(since_date, date_format))
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+class DownloadPool(object):
+    """图片/视频并发下载线程池，同时限制每个CDN域名的并发下载数"""
+    def __init__(self, max_workers=8, max_per_host=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_per_host = max_per_host
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+
+    def get_semaphore(self, url):
+        """获取url所在域名的信号量"""
+        host = urlparse(url).netloc
+        with self.lock:
+            semaphore = self.host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_per_host)
+                self.host_semaphores[host] = semaphore
+            return semaphore
+
+    def run(self, url, func, *args):
+        with self.get_semaphore(url):
+            return func(*args)
+
+    def submit(self, url, func, *args):
+        """提交一个下载任务，返回Future"""
+        return self.executor.submit(self.run, url, func, *args)
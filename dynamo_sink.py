@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+from pynamodb.constants import PAY_PER_REQUEST_BILLING_MODE
+
+from model import UserModel, WeiboModel
+from records import dynamo_user_attributes, dynamo_weibo_attributes
+
+
+class DynamoSink(object):
+    """把用户和微博写入DynamoDB
+
+    表在启动时检查一次，不存在时创建并等待可用，on_demand为True时使用
+    按请求计费，否则沿用原来的预置容量。写入经由Model.batch_write()，每25条
+    发送一次BatchWriteItem，未处理完的条目由pynamodb按Meta中的退避参数重试。
+    每次写入返回消耗的写容量单位
+    """
+    def __init__(self, on_demand=False):
+        self.local = threading.local()  # 各线程分别统计本次写入消耗的容量
+        for model, capacity in ((UserModel, 1), (WeiboModel, 10)):
+            if on_demand:
+                model.create_table(wait=True,
+                                   billing_mode=PAY_PER_REQUEST_BILLING_MODE)
+            else:
+                model.create_table(wait=True,
+                                   read_capacity_units=capacity,
+                                   write_capacity_units=capacity)
+            self.meter(model)
+
+    def meter(self, model):
+        """包装表连接的batch_write_item，累计响应中的ConsumedCapacity
+
+        pynamodb每次请求都会要求返回消耗的容量，但batch_write()不把它交给调用者
+        """
+        connection = model._get_connection()
+        batch_write_item = connection.batch_write_item
+
+        def metered_batch_write_item(*args, **kwargs):
+            data = batch_write_item(*args, **kwargs)
+            capacity_list = (data or {}).get('ConsumedCapacity') or []
+            if isinstance(capacity_list, dict):
+                capacity_list = [capacity_list]
+            for capacity in capacity_list:
+                self.local.capacity = getattr(self.local, 'capacity',
+                                              0) + capacity.get(
+                                                  'CapacityUnits', 0)
+            return data
+
+        connection.batch_write_item = metered_batch_write_item
+
+    def write(self, model, items):
+        """批量写入，返回消耗的写容量单位"""
+        self.local.capacity = 0
+        with model.batch_write() as batch:
+            for item in items:
+                batch.save(item)
+        return self.local.capacity
+
+    def write_user(self, user):
+        item = UserModel(user['id'], **dynamo_user_attributes(user))
+        return self.write(UserModel, [item])
+
+    def write_weibo(self, weibo_list):
+        items = [
+            WeiboModel(w['id'], w['bid'], **dynamo_weibo_attributes(w))
+            for w in weibo_list
+        ]
+        return self.write(WeiboModel, items)
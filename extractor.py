@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+
+from lxml import etree
+
+LOCATION_ICON = 'timeline_card_small_location_default.png'
+
+
+class PageNotReady(Exception):
+    """详情页没有返回完整的微博数据，可能被限制或页面还未生成，可以稍后重试"""
+
+
+class LayoutChanged(Exception):
+    """详情页已正常返回，但结构和预期不同，重试也无法解析"""
+
+
+class VisitorPage(Exception):
+    """返回的是新浪访客系统或登录页面，说明cookie无效或缺失，重试也无法解析"""
+
+
+class StatusExtractor(object):
+    """从微博详情页html中增量提取"status"对象
+
+    详情页形如 var $render_data = [{"status": {...}, "hotScheme": ...}][0] || {};
+    每次喂入一段文本，找到"status":之前只保留可能跨段的结尾；找到之后，
+    每当新的一段中有右花括号就用json的raw_decode从对象开头解析一次，
+    raw_decode在对象结束处停止，不理会之后的内容
+    """
+    MARKER = '"status":'
+    PAGE_MARKER = '$render_data'
+    VISITOR_MARKERS = ('Sina Visitor System', 'passport.weibo.cn/signin')
+    OVERLAP = max(len(m) for m in (MARKER, PAGE_MARKER) + VISITOR_MARKERS)
+
+    def __init__(self):
+        self.pending = ''  # 尚未找到MARKER时保留的文本
+        self.has_page_marker = False
+        self.is_visitor = False
+        self.parts = []
+        self.started = False
+        self.done = False
+        self.status = None
+        self.decoder = json.JSONDecoder(strict=False)
+
+    def feed(self, text):
+        """喂入一段文本，status对象结束时返回True"""
+        if self.done:
+            return True
+        if not self.started:
+            text = self.pending + text
+            if not self.has_page_marker:
+                self.has_page_marker = self.PAGE_MARKER in text
+            if not self.is_visitor:
+                self.is_visitor = any(m in text for m in self.VISITOR_MARKERS)
+            index = text.find(self.MARKER)
+            if index < 0:
+                self.pending = text[-self.OVERLAP:]
+                return False
+            text = text[index + len(self.MARKER):].lstrip()
+            self.pending = ''
+            self.started = True
+        elif not self.parts:
+            text = text.lstrip()
+        if not text:
+            return False
+        if not self.parts and text[0] != '{':
+            raise LayoutChanged(u'详情页中status不是对象')
+        self.parts.append(text)
+        if '}' in text:  # 对象只可能在右花括号处结束
+            self.decode()
+        return self.done
+
+    def decode(self):
+        if len(self.parts) > 1:
+            self.parts = [''.join(self.parts)]
+        try:
+            self.status = self.decoder.raw_decode(self.parts[0])[0]
+            self.done = True
+        except ValueError as e:  # 对象还不完整，或者json本身有误
+            # 出错位置之后还有右花括号说明出错的部分已经读完，再读也无法解析；
+            # 否则是读到了未完的字符串、数字或true等
+            rest = self.parts[0][e.pos:]
+            if '}' in rest and not e.msg.startswith('Unterminated string'):
+                raise LayoutChanged(u'详情页中status解析失败：%s' % e)
+
+    def result(self):
+        """返回解析后的status对象"""
+        if not self.done:
+            raise self.error()
+        return self.status
+
+    def error(self):
+        """页面读完仍未得到status对象时，判断是应该重试还是页面结构变了"""
+        if self.started:
+            return PageNotReady(u'详情页不完整')
+        if self.has_page_marker:
+            return LayoutChanged(u'详情页中没有找到status')
+        if self.is_visitor:
+            return VisitorPage(u'详情页返回了访客或登录页面，请检查cookie')
+        return PageNotReady(u'详情页中没有微博数据')
+
+
+def extract_status(chunks, encoding='utf-8'):
+    """从详情页的字节流中提取status对象，找到后不再读取剩余的内容"""
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    extractor = StatusExtractor()
+    for chunk in chunks:
+        if extractor.feed(decoder.decode(chunk)):
+            break
+    return extractor.result()
+
+
+def extract_body(text_body):
+    """遍历一次微博正文html，同时提取正文、头条文章url、位置、话题和@用户"""
+    selector = etree.HTML(text_body)
+    if selector is None:
+        return '', '', '', '', ''
+    spans = []
+    location_index = -1
+    article_url = None
+    topic_list = []
+    at_list = []
+    for node in selector.iter('span', 'a'):
+        if node.tag == 'span':
+            if location_index < 0:
+                img = node.find('img')
+                if img is not None and LOCATION_ICON in img.get('src', ''):
+                    location_index = len(spans)
+            spans.append(node)
+            if node.get('class') == 'surl-text':
+                topic = ''.join(node.itertext())
+                if len(topic) > 2 and topic[0] == '#' and topic[-1] == '#':
+                    topic_list.append(topic[1:-1])
+        else:
+            if article_url is None and node.get('data-url') is not None:
+                article_url = node.get('data-url')
+            href = node.get('href')
+            if href is not None:
+                at_user = ''.join(node.itertext())
+                if '@' + href[3:] == at_user:
+                    at_list.append(at_user[1:])
+    text = ''.join(selector.itertext())
+    if not (text.startswith(u'发布了头条文章') and article_url
+            and article_url.startswith('http://t.cn')):
+        article_url = ''
+    location = ''
+    if 0 <= location_index < len(spans) - 1:
+        location = ''.join(spans[location_index + 1].itertext())
+    return text, article_url, location, ','.join(topic_list), ','.join(
+        at_list)
@@ -1,11 +1,28 @@
+import json
 import mimetypes
+import os
+import threading
+import time
 
 from io import BufferedReader, BytesIO
+
+import requests
 from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
 from pydrive2.files import GoogleDriveFile
 
 
+UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v2/files'
+CHUNK_SIZE = 8 * 256 * 1024  # Drive requires chunks in multiples of 256 KB
+refresh_lock = threading.Lock()
+
+
+class FolderNotFound(Exception):
+    '''
+    Drive reported that the parent folder of an upload does not exist.
+    '''
+
+
 def initial_gdrive():
     '''
     Authorize and refresh Google Drive token.
@@ -40,3 +57,215 @@ class GoogleDriveFileWithBytes(GoogleDriveFile):
 class GoogleDriveWithBytes(GoogleDrive):
     def CreateFile(self, metadata=None):
         return GoogleDriveFileWithBytes(auth=self.auth, metadata=metadata)
+
+
+class FolderCache(object):
+    '''
+    Map (parent id, title) to the id of a Drive folder. The mapping is kept in
+    memory and saved to a JSON file so it can be reused across runs.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.folders = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.folders = json.load(f)
+            except ValueError:
+                self.folders = {}
+
+    def get(self, parent_id, title):
+        with self.lock:
+            return self.folders.get(parent_id, {}).get(title)
+
+    def set(self, parent_id, title, folder_id):
+        with self.lock:
+            self.folders.setdefault(parent_id, {})[title] = folder_id
+            self.save()
+
+    def invalidate(self, folder_id):
+        '''
+        Forget a folder Drive reported as missing, together with the
+        folders cached under it.
+        '''
+        with self.lock:
+            self.folders.pop(folder_id, None)
+            for children in self.folders.values():
+                for title, child_id in list(children.items()):
+                    if child_id == folder_id:
+                        del children[title]
+            self.save()
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.folders, f, ensure_ascii=False)
+
+
+class FileManifest(object):
+    '''
+    Set of file titles in one Drive folder. It is built once with a paginated
+    listing, updated as uploads finish and saved locally (one title per line)
+    so later runs don't list the folder again.
+    '''
+    def __init__(self, drive, folder_id, path, page_size=1000):
+        self.path = path
+        self.lock = threading.Lock()
+        self.titles = set()
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                self.titles = set(f.read().splitlines())
+        else:
+            query = {
+                'q': "'{}' in parents and trashed=false".format(folder_id),
+                'maxResults': page_size
+            }
+            for file_list in drive.ListFile(query):
+                for file in file_list:
+                    self.titles.add(file['title'])
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(title + '\n' for title in self.titles)
+
+    def __contains__(self, title):
+        return title in self.titles
+
+    def add(self, title):
+        with self.lock:
+            if title not in self.titles:
+                self.titles.add(title)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(title + '\n')
+
+
+class ResumableUpload(object):
+    '''
+    Upload a stream of bytes to Google Drive with the resumable upload protocol.
+    At most one chunk is kept in memory, and a failed chunk is resumed from the
+    last offset acknowledged by Drive instead of restarting the whole upload.
+    Reference: https://developers.google.com/drive/api/v2/manage-uploads#resumable
+    '''
+    def __init__(self, session, auth, metadata, upload_url=UPLOAD_URL,
+                 chunk_size=CHUNK_SIZE, max_retries=5):
+        self.session = session
+        self.auth = auth
+        self.metadata = metadata
+        self.upload_url = upload_url
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.location = None
+
+    def get_headers(self):
+        with refresh_lock:
+            if self.auth.access_token_expired:
+                self.auth.Refresh()
+            return {'Authorization': 'Bearer ' + self.auth.credentials.access_token}
+
+    def start(self):
+        '''
+        Open an upload session and remember its URI.
+        '''
+        headers = self.get_headers()
+        if self.metadata.get('mimeType'):
+            headers['X-Upload-Content-Type'] = self.metadata['mimeType']
+        r = self.session.post(self.upload_url,
+                              params={'uploadType': 'resumable'},
+                              json=self.metadata,
+                              headers=headers,
+                              timeout=(5, 30))
+        if r.status_code == 404:  # the only id in the request is the parent
+            raise FolderNotFound(', '.join(
+                parent['id'] for parent in self.metadata.get('parents', [])))
+        r.raise_for_status()
+        self.location = r.headers['Location']
+
+    def put(self, data, content_range):
+        headers = self.get_headers()
+        headers['Content-Range'] = content_range
+        return self.session.put(self.location,
+                                data=bytes(data),
+                                headers=headers,
+                                timeout=(5, 60),
+                                allow_redirects=False)
+
+    def parse_response(self, r):
+        '''
+        Return the uploaded file resource when the upload is finished,
+        otherwise the number of bytes Drive has persisted.
+        '''
+        if r.status_code in (200, 201):
+            return r.json()
+        if r.status_code == 308:
+            uploaded = r.headers.get('Range')
+            return int(uploaded.split('-')[-1]) + 1 if uploaded else 0
+        r.raise_for_status()
+        raise requests.exceptions.HTTPError(
+            'Unexpected status %d' % r.status_code, response=r)
+
+    def send(self, data, offset, total=None):
+        '''
+        Send one chunk starting at offset and return the number of bytes
+        Drive has persisted. Pass total with the last chunk; once Drive has
+        all of it the uploaded file resource is returned instead. After a
+        failed request Drive is asked what it kept and the rest is resent,
+        until the chunk is acknowledged or max_retries is used up.
+        '''
+        size = '*' if total is None else str(total)
+        start = offset
+        failures = 0
+        need_query = False
+        while True:
+            try:
+                if need_query:
+                    result = self.query()
+                else:
+                    if data:
+                        content_range = 'bytes %d-%d/%s' % (
+                            offset, offset + len(data) - 1, size)
+                    else:
+                        content_range = 'bytes */%s' % size
+                    result = self.parse_response(self.put(data, content_range))
+                    if not isinstance(result, dict) and result <= offset:
+                        raise requests.exceptions.RequestException(
+                            'Drive did not accept any bytes of the chunk')
+                need_query = False
+                if isinstance(result, dict):
+                    return result
+                if result < offset:
+                    raise requests.exceptions.RequestException(
+                        'Drive lost bytes that were already acknowledged')
+            except requests.exceptions.RequestException as e:
+                response = getattr(e, 'response', None)
+                if (response is not None and response.status_code < 500
+                        and response.status_code != 429):
+                    raise
+                failures += 1
+                if failures > self.max_retries:
+                    raise
+                time.sleep(2 ** failures)
+                need_query = True
+                continue
+            data = data[result - offset:]
+            offset = result
+            if total is None and offset > start:
+                return offset
+
+    def query(self):
+        '''
+        Ask Drive how many bytes of the interrupted upload it already has.
+        '''
+        return self.parse_response(self.put(b'', 'bytes */*'))
+
+    def upload(self, chunks):
+        '''
+        Upload an iterable of byte strings, e.g. response.iter_content().
+        '''
+        self.start()
+        buffer = bytearray()
+        offset = 0  # position of buffer[0] in the file
+        for data in chunks:
+            buffer += data
+            while len(buffer) > self.chunk_size:
+                uploaded = self.send(buffer[:self.chunk_size], offset)
+                del buffer[:uploaded - offset]
+                offset = uploaded
+        return self.send(buffer, offset, offset + len(buffer))
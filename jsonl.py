@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+import os
+import sys
+
+from post_index import IdSet
+from records import document
+
+
+class JsonLinesWriter(object):
+    """只追加的json lines结果文件
+
+    每行一条微博，更新已写入的微博时在文件末尾追加新版本，不改写已有内容；
+    同目录的.idx索引文件每行为"微博id<TAB>最新版本所在行的偏移量"，同样只追加。
+    写入时内存中只保留紧凑的微博id集合，偏移量在读取时才从索引文件加载。
+    用户信息很小，单独保存在.user.json文件中，每次整体覆盖
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.user_path = os.path.splitext(path)[0] + '.user.json'
+        self.ids = IdSet(compact=True)  # 已写入的微博id
+        self.stale = 0  # 已被新版本取代的旧行数
+        if os.path.isfile(path):
+            self.load_index()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add_id(self, weibo_id):
+        if not self.ids.add(weibo_id):
+            self.stale += 1
+
+    def read_index(self):
+        """返回索引中的(微博id, 偏移量)，同一微博的新版本在后"""
+        if not os.path.isfile(self.index_path):
+            return
+        with codecs.open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                info = line.rstrip('\n').split('\t')
+                if len(info) == 2 and info[1].isdigit():
+                    yield int(info[0]), int(info[1])
+
+    def read_offsets(self):
+        """微博id到最新版本偏移量，按微博第一次写入的顺序排列"""
+        return dict(self.read_index())
+
+    def load_index(self):
+        """读取索引，并补上索引中缺少的行，如写完结果文件后、写索引前程序中断"""
+        ids = []
+        last = -1
+        for weibo_id, offset in self.read_index():
+            ids.append(weibo_id)
+            last = max(last, offset)
+        if last >= os.path.getsize(self.path):  # 结果文件被替换或截断过，重建索引
+            ids = []
+            last = -1
+            open(self.index_path, 'w').close()
+        self.ids.update(ids)
+        self.stale = len(ids) - len(self.ids)
+        self.scan(last)
+
+    def scan(self, last):
+        """从偏移量为last的行之后扫描结果文件，把未建索引的行加入索引"""
+        index_lines = []
+        with open(self.path, 'rb+') as f:
+            if last >= 0:
+                f.seek(last)
+                f.readline()
+            offset = f.tell()
+            for line in f:
+                if not line.endswith(b'\n'):  # 写到一半中断的行，截掉后再追加
+                    f.truncate(offset)
+                    break
+                weibo_id = json.loads(line.decode('utf-8'))['id']
+                self.add_id(weibo_id)
+                index_lines.append(u'%d\t%d\n' % (weibo_id, offset))
+                offset += len(line)
+        if index_lines:
+            with codecs.open(self.index_path, 'a', encoding='utf-8') as f:
+                f.writelines(index_lines)
+
+    def write(self, user, weibo_list):
+        """追加写入微博，已存在的微博以新版本为准
+
+        出错时截掉本批已写入的部分，id也不记为已写入，重试时整批重写
+        """
+        self.write_user(user)
+        start = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        lines = []
+        index_lines = []
+        offset = start
+        for w in weibo_list:
+            line = (json.dumps(document(w), ensure_ascii=False) +
+                    '\n').encode('utf-8')
+            lines.append(line)
+            index_lines.append(u'%d\t%d\n' % (w['id'], offset))
+            offset += len(line)
+        try:
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(lines))
+            # 先写结果再写索引，中断时索引只会缺行，下次打开时由scan补上
+            with codecs.open(self.index_path, 'a', encoding='utf-8') as f:
+                f.writelines(index_lines)
+        except Exception:
+            os.truncate(self.path, start)  # 索引中指向截掉部分的行在下次打开时重建
+            raise
+        for w in weibo_list:
+            self.add_id(w['id'])
+
+    def write_user(self, user):
+        temp_path = self.user_path + '.part'
+        with codecs.open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(document(user), f, ensure_ascii=False)
+        os.replace(temp_path, self.user_path)
+
+    def read_user(self):
+        if not os.path.isfile(self.user_path):
+            return {}
+        with codecs.open(self.user_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def lines(self):
+        """按微博第一次写入的顺序返回每条微博最新版本的json文本(bytes)"""
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            if not self.stale:  # 没有旧版本时顺序读取即可
+                for line in f:
+                    yield line.rstrip(b'\n')
+                return
+            for offset in self.read_offsets().values():
+                f.seek(offset)
+                yield f.readline().rstrip(b'\n')
+
+    def records(self):
+        for line in self.lines():
+            yield json.loads(line.decode('utf-8'))
+
+    def compact(self, json_path):
+        """生成与json写入模式格式相同的单个json文件，返回其中的微博数
+
+        每行本身就是json.dumps的结果，直接拼接，不需要重新解析和序列化
+        """
+        user = json.dumps(self.read_user(), ensure_ascii=False)
+        temp_path = json_path + '.part'
+        with open(temp_path, 'wb') as f:
+            f.write(('{"user": %s, "weibo": [' % user).encode('utf-8'))
+            for i, line in enumerate(self.lines()):
+                if i:
+                    f.write(b', ')
+                f.write(line)
+            f.write(b']}')
+        os.replace(temp_path, json_path)
+        return len(self.ids)
+
+
+def find_jsonl_files(path):
+    if os.path.isfile(path):
+        return [path]
+    file_list = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.endswith('.jsonl'):
+                file_list.append(os.path.join(root, name))
+    return file_list
+
+
+def main():
+    """把json lines结果文件合并为单个json文件，如：
+    python jsonl.py weibo/Dear-迪丽热巴/1669879400.jsonl
+    不指定路径时合并weibo文件夹下的全部.jsonl文件
+    """
+    paths = sys.argv[1:] or [
+        os.path.split(os.path.realpath(__file__))[0] + os.sep + 'weibo'
+    ]
+    for path in paths:
+        for file_path in find_jsonl_files(path):
+            json_path = os.path.splitext(file_path)[0] + '.json'
+            count = JsonLinesWriter(file_path).compact(json_path)
+            print(u'%d条微博已合并到%s' % (count, json_path))
+
+
+if __name__ == '__main__':
+    main()
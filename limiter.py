@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+
+THROTTLE_STATUS_CODES = (403, 418, 429)  # 微博限制访问时返回的HTTP状态码
+
+
+class RateLimiter(object):
+    """自适应令牌桶限速器，所有爬取线程共享同一个请求速率预算
+
+    请求正常时速率逐步提高，最高到max_rate；发现被限制时速率减半，
+    并按连续被限制的次数指数退避，退避期间所有线程都暂停请求。
+    暂停开始前已发出的请求的结果不再计入，每次暂停只算一次被限制
+    """
+    def __init__(self,
+                 rate,
+                 burst=3,
+                 max_rate=None,
+                 min_rate=None,
+                 jitter=0.5,
+                 backoff=5,
+                 max_backoff=600):
+        self.base_rate = float(rate)
+        self.rate = float(rate)  # 当前每秒补充的令牌数，即平均每秒请求数
+        self.max_rate = float(max_rate or rate * 2)
+        self.min_rate = float(min_rate or rate / 16.0)
+        self.capacity = burst  # 桶容量，允许的最大突发请求数
+        self.jitter = jitter  # 每次请求额外随机等待0到jitter个请求间隔，模拟人的操作
+        self.backoff = backoff  # 第一次被限制时暂停的秒数
+        self.max_backoff = max_backoff
+        self.failures = 0  # 连续被限制的次数
+        self.paused_at = 0  # 最近一次开始暂停的时间
+        self.local = threading.local()  # 各线程最近一次发出请求的时间
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """取一个令牌，令牌不足时等待
+
+        等待期间如果开始了新的暂停，之前预订的令牌作废，醒来后重新排到暂停之后
+        """
+        while True:
+            with self.lock:
+                self.refill()
+                self.tokens -= 1  # 先预订令牌，再在锁外等待，保证各线程按先后顺序排队
+                wait = -self.tokens / self.rate if self.tokens < 0 else 0
+                wait += random.uniform(0, self.jitter / self.rate)
+                paused_at = self.paused_at
+            time.sleep(wait)
+            with self.lock:
+                if self.paused_at == paused_at:
+                    self.local.sent = time.time()
+                    return
+
+    def is_stale(self):
+        """本线程的请求是否在当前暂停开始前发出，调用时需持有锁"""
+        sent = getattr(self.local, 'sent', None)
+        return sent is not None and sent < self.paused_at
+
+    def succeeded(self):
+        """请求正常，缓慢提高速率"""
+        with self.lock:
+            if self.is_stale():
+                return
+            self.failures = 0
+            if self.rate < self.max_rate:
+                self.refill()
+                self.rate = min(self.max_rate,
+                                self.rate + self.base_rate * 0.05)
+
+    def throttled(self):
+        """请求被限制，速率减半并暂停一段时间"""
+        with self.lock:
+            if self.is_stale():
+                return  # 暂停前发出的请求被限制是同一次限制，不再加倍
+            self.refill()
+            self.failures += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = min(self.max_backoff,
+                        self.backoff * 2**(self.failures - 1))
+            pause *= random.uniform(1, 1.5)
+            # 令牌欠账，之后的请求都要等到欠账还清，即暂停pause秒；
+            # 已预订令牌还在等待的线程醒来后发现paused_at变了，会重新排队
+            self.tokens = -pause * self.rate
+            self.paused_at = time.time()
@@ -1,14 +1,13 @@
 import os
+import mimetypes
 import time
 import sys
-import copy
+import threading
 import traceback
-import requests
-from requests.adapters import HTTPAdapter
 
-from model import UserModel, WeiboModel
+from dynamo_sink import DynamoSink
 from weibo import Weibo, get_config
-from gdrive import initial_gdrive
+from gdrive import initial_gdrive, FileManifest, FolderCache, FolderNotFound, ResumableUpload
 
 
 class WeiboCrawler(Weibo):
@@ -17,8 +16,15 @@ class WeiboCrawler(Weibo):
         self.gdrive_root = config['gdrive_root']
         self.gdrive_id = ''
         self.object_id = ''
-        self.gdrive_files = []
+        cache_dir = os.path.split(os.path.realpath(__file__))[0]
+        self.folder_cache = FolderCache(cache_dir + os.sep + 'gdrive_folders.json')  # (父目录id, 目录名)到Drive目录id的缓存
+        self.manifest_dir = cache_dir + os.sep + 'gdrive_manifests'  # 每个Drive目录已有文件名的本地清单
+        self.gdrive_manifests = {}
+        self.gdrive_lock = threading.Lock()  # pydrive2底层的httplib2非线程安全，多线程时串行调用Drive目录和文件列表接口
         super().__init__(config)
+        self.dynamo_sink = None
+        if 'dynamo' in self.write_mode:  # 启动时检查或创建DynamoDB表
+            self.dynamo_sink = DynamoSink(config.get('dynamo_on_demand', 0))
 
 
     def validate_config(self, config):
@@ -38,14 +44,46 @@ class WeiboCrawler(Weibo):
         if (not self.is_date(since_date)) and (not since_date.isdigit()):
             sys.exit(u'since_date值应为yyyy-mm-dd形式或整数,请重新输入')
 
+        for argument in [
+                'full_crawl', 'csv_update', 'mysql_load_data',
+                'dynamo_on_demand'
+        ]:
+            if config.get(argument, 0) not in (0, 1):
+                sys.exit(u'%s值应为0或1,请重新输入' % argument)
+
+        # 验证user_threads、download_threads、request_rate
+        for argument in ['user_threads', 'download_threads']:
+            value = config.get(argument, 1)
+            if not isinstance(value, int) or value < 1:
+                sys.exit(u'%s值应为正整数,请重新输入' % argument)
+        for argument in ['request_rate', 'max_request_rate']:
+            rate = config.get(argument, 1)
+            if not isinstance(rate, (int, float)) or rate <= 0:
+                sys.exit(u'%s值应为正数,请重新输入' % argument)
+        if config.get('max_request_rate') is not None and config[
+                'max_request_rate'] < config.get('request_rate', 1):
+            sys.exit(u'max_request_rate值不能小于request_rate,请重新输入')
+        cache_days = config.get('cache_days', 1)
+        if not isinstance(cache_days, (int, float)) or cache_days < 0:
+            sys.exit(u'cache_days值应为非负数,请重新输入')
+
+        # 验证buffer_count、buffer_bytes、sink_queue_size、sink_retries
+        for argument in ['buffer_count', 'buffer_bytes', 'sink_retries']:
+            value = config.get(argument, 0)
+            if not isinstance(value, int) or value < 0:
+                sys.exit(u'%s值应为非负整数,请重新输入' % argument)
+        sink_queue_size = config.get('sink_queue_size', 1)
+        if not isinstance(sink_queue_size, int) or sink_queue_size < 1:
+            sys.exit(u'sink_queue_size值应为正整数,请重新输入')
+
         # 验证write_mode
-        write_mode = ['csv', 'json', 'mongo', 'mysql', 'dynamo']
+        write_mode = ['csv', 'json', 'jsonl', 'mongo', 'mysql', 'dynamo']
         if not isinstance(config['write_mode'], list):
             sys.exit(u'write_mode值应为list类型')
         for mode in config['write_mode']:
             if mode not in write_mode:
                 sys.exit(
-                    u'%s为无效模式，请从csv、json、mongo、dynamo和mysql中挑选一个或多个作为write_mode' %
+                    u'%s为无效模式，请从csv、json、jsonl、mongo、dynamo和mysql中挑选一个或多个作为write_mode' %
                     mode)
 
         # 验证user_id_list
@@ -62,29 +100,14 @@ class WeiboCrawler(Weibo):
 
     
     def user_to_dynamodb(self):
-        UserModel.create_table(read_capacity_units=1, write_capacity_units=1)
-        user = UserModel(self.user['id'])
-        user.screen_name  = self.user['screen_name']
-        user.gender  = self.user['gender']
-        user.statuses_count  = self.user['statuses_count']
-        user.followers_count  = self.user['followers_count']
-        user.follow_count  = self.user['follow_count']
-        user.registration_time = self.user['registration_time']
-        user.sunshine = self.user['sunshine']
-        user.birthday = self.user['birthday']
-        user.location = self.user['location']
-        user.education = self.user['education']
-        user.company = self.user['company']
-        user.description  = self.user['description']
-        user.profile_url  = self.user['profile_url']
-        user.profile_image_url  = self.user['profile_image_url']
-        user.avatar_hd  = self.user['avatar_hd']
-        user.urank  = self.user['urank']
-        user.mbrank  = self.user['mbrank']
-        user.verified  = self.user['verified']
-        user.verified_type  = self.user['verified_type']
-        user.verified_reason  = self.user['verified_reason']
-        user.save()
+        """将爬取的用户信息写入DynamoDB数据库"""
+        try:
+            capacity = self.dynamo_sink.write_user(self.user)
+            print(u'%s信息写入DynamoDB数据库完毕，消耗%s个写容量单位' %
+                  (self.user['screen_name'], capacity))
+        except Exception as e:
+            print('Error: ', e)
+            traceback.print_exc()
 
 
     def user_to_database(self):
@@ -106,56 +129,96 @@ class WeiboCrawler(Weibo):
     def download_one_file(self, url, file_path, type1, weibo_id, gdrive_saved_id, file_name):
         """下载单个文件(图片/视频)"""
         try:
-            if not self.gdrive_files:
-                file_list = self.drive.ListFile({'q':"'{}' in parents and trashed=False".format(gdrive_saved_id)}).GetList()
-                for file in file_list:
-                    self.gdrive_files.append(file['title'])
-            if file_name not in self.gdrive_files:
-                file1 = self.drive.CreateFile({"parents": [{"kind": "drive#fileLink", "id": gdrive_saved_id}], 'title': file_name})
-                s = requests.Session()
-                s.mount(url, HTTPAdapter(max_retries=5))
-                downloaded = s.get(url, cookies=self.cookie, timeout=(5, 10))
-                file1.SetContentBytes(downloaded.content, file_name)
-                file1.Upload()
-                    
+            manifest = self.get_gdrive_manifest(gdrive_saved_id)
+            if file_name not in manifest:
+                metadata = {
+                    'parents': [{'kind': 'drive#fileLink', 'id': gdrive_saved_id}],
+                    'title': file_name
+                }
+                mime_type = mimetypes.guess_type(file_name)[0]
+                if mime_type:
+                    metadata['mimeType'] = mime_type
+                # 边下载边分块上传，内存中只保留一个分块，上传中断时从Drive已保存的位置续传
+                with self.session.get(url,
+                                      headers=self.headers,
+                                      timeout=(5, 10),
+                                      stream=True) as downloaded:
+                    downloaded.raise_for_status()
+                    upload = ResumableUpload(self.session, self.drive.auth, metadata)
+                    upload.upload(downloaded.iter_content(chunk_size=256 * 1024))
+                manifest.add(file_name)
 
         except Exception as e:
+            # 只有Drive报告上传的目标目录不存在时才清除缓存，微博图片404等其他错误不影响缓存
+            if isinstance(e, FolderNotFound):
+                self.folder_cache.invalidate(gdrive_saved_id)  # 目录已在Drive中被删除
+                self.remove_gdrive_manifest(gdrive_saved_id)
             error_file = self.get_filepath(
                 type1) + os.sep + 'not_downloaded.txt'
-            with open(error_file, 'ab') as f:
-                url = str(weibo_id) + ':' + url + '\n'
-                f.write(url.encode(sys.stdout.encoding))
+            with self.download_lock:
+                with open(error_file, 'ab') as f:
+                    url = str(weibo_id) + ':' + url + '\n'
+                    f.write(url.encode(sys.stdout.encoding))
             print('Error: ', e)
             traceback.print_exc()
 
 
+    def get_gdrive_manifest(self, folder_id):
+        """获取Drive目录的文件清单，本地没有时分页列出目录文件"""
+        with self.gdrive_lock:
+            manifest = self.gdrive_manifests.get(folder_id)
+            if manifest is None:
+                if not os.path.isdir(self.manifest_dir):
+                    os.makedirs(self.manifest_dir)
+                manifest = FileManifest(self.drive, folder_id,
+                                        self.manifest_dir + os.sep + folder_id + '.txt')
+                self.gdrive_manifests[folder_id] = manifest
+            return manifest
+
+
+    def remove_gdrive_manifest(self, folder_id):
+        """删除已不存在的Drive目录的文件清单"""
+        with self.gdrive_lock:
+            self.gdrive_manifests.pop(folder_id, None)
+            manifest_path = self.manifest_dir + os.sep + folder_id + '.txt'
+            if os.path.isfile(manifest_path):
+                os.remove(manifest_path)
+
+
     def create_gdrive_directory(self, parents, title):
         '''
             Create a new Google Drive directory.
         '''
+        folder_id = self.folder_cache.get(parents, title)
+        if folder_id:
+            return folder_id
         try:
-            f = self.drive.ListFile({"q": "'{}' in parents and trashed=false and "
-                                          "mimeType='application/vnd.google-apps.folder' and "
-                                          "title='{}'".format(parents, title)}).GetList()
-            if len(f) > 0:
-                return f[0]['id']
-            folder_metadata = {
-                'parents': [{'id': parents}],
-                'title': title,
-                # The mimetype defines this new file as a folder, so don't change this.
-                'mimeType': 'application/vnd.google-apps.folder'
-            }
-            folder = self.drive.CreateFile(folder_metadata)
-            folder.Upload()
-            return folder['id']
+            with self.gdrive_lock:
+                f = self.drive.ListFile({"q": "'{}' in parents and trashed=false and "
+                                              "mimeType='application/vnd.google-apps.folder' and "
+                                              "title='{}'".format(parents, title)}).GetList()
+                if len(f) > 0:
+                    self.folder_cache.set(parents, title, f[0]['id'])
+                    return f[0]['id']
+                folder_metadata = {
+                    'parents': [{'id': parents}],
+                    'title': title,
+                    # The mimetype defines this new file as a folder, so don't change this.
+                    'mimeType': 'application/vnd.google-apps.folder'
+                }
+                folder = self.drive.CreateFile(folder_metadata)
+                folder.Upload()
+                self.folder_cache.set(parents, title, folder['id'])
+                return folder['id']
         except Exception as e:
             time.sleep(10)
             return self.create_gdrive_directory(parents, title)
 
 
     def handle_download(self, file_type, file_dir, urls, w):
-        """处理下载相关操作"""
-        file_prefix = w['created_at'][:11].replace('-', '') + '_' + str(
+        """处理下载相关操作，返回待下载任务列表"""
+        jobs = []
+        file_prefix = w['created_at'][:10].replace('-', '') + '_' + str(
             w['id'])
         gdrive_saved_id = self.create_gdrive_directory(self.gdrive_id, file_type)
         if file_type == 'img': 
@@ -169,7 +232,7 @@ class WeiboCrawler(Weibo):
                         file_suffix = url[index:]
                     file_name = file_prefix + '_' + str(i + 1) + file_suffix
                     file_path = file_dir + os.sep + file_name
-                    self.download_one_file(url, file_path, file_type, w['id'], gdrive_saved_id, file_name)
+                    jobs.append((url, file_path, file_type, w['id'], gdrive_saved_id, file_name))
             else:
                 index = urls.rfind('.')
                 if len(urls) - index > 5:
@@ -178,7 +241,7 @@ class WeiboCrawler(Weibo):
                     file_suffix = urls[index:]
                 file_name = file_prefix + file_suffix
                 file_path = file_dir + os.sep + file_name
-                self.download_one_file(urls, file_path, file_type, w['id'], gdrive_saved_id, file_name)
+                jobs.append((urls, file_path, file_type, w['id'], gdrive_saved_id, file_name))
         else:
             file_suffix = '.mp4'
             if ';' in urls:
@@ -188,69 +251,28 @@ class WeiboCrawler(Weibo):
                 for i, url in enumerate(url_list):
                     file_name = file_prefix + '_' + str(i + 1) + file_suffix
                     file_path = file_dir + os.sep + file_name
-                    self.download_one_file(url, file_path, file_type, w['id'], gdrive_saved_id, file_name)
+                    jobs.append((url, file_path, file_type, w['id'], gdrive_saved_id, file_name))
             else:
                 if urls.endswith('.mov'):
                     file_suffix = '.mov'
                 file_name = file_prefix + file_suffix
                 file_path = file_dir + os.sep + file_name
-                self.download_one_file(urls, file_path, file_type, w['id'], gdrive_saved_id, file_name)
+                jobs.append((urls, file_path, file_type, w['id'], gdrive_saved_id, file_name))
+        return jobs
 
 
-    def info_to_dynamodb(self, collection, info_list):
-        WeiboModel.create_table(read_capacity_units=10, write_capacity_units=10)
-        if len(self.write_mode) > 1:
-            new_info_list = copy.deepcopy(info_list)
-        else:
-            new_info_list = info_list
-        for info in new_info_list:
-            weibo = WeiboModel(info['id'], info['bid'])
-            weibo.user_id  = info['user_id']
-            weibo.screen_name  = info['screen_name']
-            weibo.text  = info['text']
-            weibo.article_url = info['article_url']
-            weibo.topics  = info['topics']
-            weibo.at_users  = info['at_users']
-            weibo.pics  = info['pics']
-            weibo.video_url  = info['video_url']
-            weibo.location  = info['location']
-            weibo.created_at  = info['created_at']
-            weibo.source  = info['source']
-            weibo.attitudes_count  = info['attitudes_count']
-            weibo.comments_count  = info['comments_count']
-            weibo.reposts_count  = info['reposts_count']
-            weibo.save()
-
-
-    def weibo_to_dynamodb(self, wrote_count):
-        """将爬取的微博信息写入DynamoDB数据库"""
-        self.info_to_dynamodb('weibo', self.weibo[wrote_count:])
-        print(u'%d条微博写入DynamoDB数据库完毕' % self.got_count)
-
-
-    def write_data(self, wrote_count):
-        if self.got_count > wrote_count:
-            if 'csv' in self.write_mode:
-                self.write_csv(wrote_count)
-            if 'json' in self.write_mode:
-                self.write_json(wrote_count)
-            if 'mysql' in self.write_mode:
-                self.weibo_to_mysql(wrote_count)
-            if 'mongo' in self.write_mode:
-                self.weibo_to_mongodb(wrote_count)
-            if 'dynamo' in self.write_mode:
-                self.weibo_to_dynamodb(wrote_count)
-            if self.original_pic_download:
-                self.gdrive_files = []
-                self.download_files('img', 'original', wrote_count)
-            if self.original_video_download:
-                self.gdrive_files = []
-                self.download_files('video', 'original', wrote_count)
-            if not self.filter:
-                if self.retweet_pic_download:
-                    self.download_files('img', 'retweet', wrote_count)
-                if self.retweet_video_download:
-                    self.download_files('video', 'retweet', wrote_count)
+    def weibo_to_dynamodb(self, weibo_list):
+        """将爬取的微博信息写入DynamoDB数据库，出错时由写入线程重试"""
+        capacity = self.dynamo_sink.write_weibo(weibo_list)
+        print(u'%d条微博写入DynamoDB数据库完毕，本次消耗%s个写容量单位' %
+              (len(weibo_list), capacity))
+
+
+    def get_sinks(self):
+        sinks = super().get_sinks()
+        if 'dynamo' in self.write_mode:
+            sinks.append(('dynamo', self.weibo_to_dynamodb))
+        return sinks
 
 
 def main():
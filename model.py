@@ -13,6 +13,9 @@ class UserModel(Model):
         table_name = "weibo-user"
         aws_access_key_id = config['aws_access_key_id']
         aws_secret_access_key = config['aws_secret_access_key']
+        host = config.get('dynamo_host')  # 如http://localhost:8000，使用DynamoDB Local时填写
+        max_retry_attempts = 8  # batch_write未处理完的条目按指数退避重试的次数
+        base_backoff_ms = 100
 
     id  = UnicodeAttribute(hash_key=True)
     screen_name  = UnicodeAttribute(null=True)
@@ -42,6 +45,9 @@ class WeiboModel(Model):
         table_name = "weibo-post"
         aws_access_key_id = config['aws_access_key_id']
         aws_secret_access_key = config['aws_secret_access_key']
+        host = config.get('dynamo_host')  # 如http://localhost:8000，使用DynamoDB Local时填写
+        max_retry_attempts = 8  # batch_write未处理完的条目按指数退避重试的次数
+        base_backoff_ms = 100
 
     id  = NumberAttribute(hash_key=True)
     bid  = UnicodeAttribute(range_key=True)
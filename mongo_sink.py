@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import OperationFailure
+
+from records import document
+
+logger = logging.getLogger('weibo')
+
+
+class MongoSink(object):
+    """把用户和微博写入MongoDB
+
+    整个运行只创建一个MongoClient(线程安全，所有用户和线程共用)，启动时在
+    user和weibo集合的id上建唯一索引；每批数据用一次无序bulk_write写入，
+    每个文档对应一个ReplaceOne(upsert=True)，写入不会修改传入的字典
+    """
+    def __init__(self, database='weibo', **kwargs):
+        self.client = MongoClient(**kwargs)
+        self.db = self.client[database]
+        for name in ('user', 'weibo'):
+            try:
+                self.db[name].create_index('id', unique=True)
+            except OperationFailure as e:  # 旧数据中有重复id时无法建唯一索引
+                logger.warning(u'无法在%s集合的id上建立唯一索引：%s', name, e)
+                self.db[name].create_index('id')
+
+    def write(self, collection, info_list):
+        if not info_list:
+            return None
+        requests = [
+            ReplaceOne({'id': info['id']}, document(info), upsert=True)
+            for info in info_list
+        ]
+        return self.db[collection].bulk_write(requests, ordered=False)
+
+    def close(self):
+        self.client.close()
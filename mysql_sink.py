@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import tempfile
+import threading
+
+import pymysql
+
+from records import (MYSQL_USER_COLUMNS, MYSQL_WEIBO_COLUMNS, mysql_user_row,
+                     mysql_weibo_rows)
+
+logger = logging.getLogger('weibo')
+
+CHUNK_BYTES = 2 * 1024 * 1024  # 每条INSERT语句的最大字节数
+
+CREATE_DATABASE = """CREATE DATABASE IF NOT EXISTS {} DEFAULT
+                  CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"""
+CREATE_USER_TABLE = """
+        CREATE TABLE IF NOT EXISTS user (
+        id varchar(20) NOT NULL,
+        screen_name varchar(30),
+        gender varchar(10),
+        statuses_count INT,
+        followers_count INT,
+        follow_count INT,
+        registration_time varchar(20),
+        sunshine varchar(20),
+        birthday varchar(40),
+        location varchar(200),
+        education varchar(200),
+        company varchar(200),
+        description varchar(400),
+        profile_url varchar(200),
+        profile_image_url varchar(200),
+        avatar_hd varchar(200),
+        urank INT,
+        mbrank INT,
+        verified BOOLEAN DEFAULT 0,
+        verified_type INT,
+        verified_reason varchar(140),
+        PRIMARY KEY (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+CREATE_WEIBO_TABLE = """
+        CREATE TABLE IF NOT EXISTS weibo (
+        id varchar(20) NOT NULL,
+        bid varchar(12) NOT NULL,
+        user_id varchar(20),
+        screen_name varchar(30),
+        text varchar(2000),
+        article_url varchar(100),
+        topics varchar(200),
+        at_users varchar(1000),
+        pics varchar(3000),
+        video_url varchar(1000),
+        location varchar(100),
+        created_at DATETIME,
+        source varchar(30),
+        attitudes_count INT,
+        comments_count INT,
+        reposts_count INT,
+        retweet_id varchar(20),
+        PRIMARY KEY (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+
+
+def tsv_value(value):
+    """转换为LOAD DATA默认格式中的一个字段"""
+    if value is None:
+        return '\\N'
+    if value is True or value is False:
+        return '1' if value else '0'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n').replace('\r', '\\r')
+
+
+class MySQLSink(object):
+    """把用户和微博写入MySQL
+
+    库和表在创建时建好，之后不再执行CREATE；每个线程复用自己的一个连接。
+    每批数据拼成多行INSERT ... ON DUPLICATE KEY UPDATE，按字节数分块，
+    块大小不超过服务器max_allowed_packet的一半；load_data为True时改用
+    LOAD DATA LOCAL INFILE，适合首次回填大量微博
+    """
+    def __init__(self, config, load_data=False, chunk_bytes=CHUNK_BYTES):
+        self.config = dict(config or {})  # 不修改调用者的配置
+        self.database = self.config.pop('db', None) or self.config.pop(
+            'database', None) or 'weibo'
+        self.config.setdefault('charset', 'utf8mb4')
+        self.load_data = load_data
+        if load_data:
+            self.config['local_infile'] = True
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []  # (线程, 连接)
+        connection = pymysql.connect(**self.config)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(CREATE_DATABASE.format(self.database))
+                cursor.execute('USE ' + self.database)
+                cursor.execute(CREATE_USER_TABLE)
+                cursor.execute(CREATE_WEIBO_TABLE)
+                cursor.execute('SELECT @@max_allowed_packet')
+                max_packet = cursor.fetchone()[0]
+            self.chunk_bytes = min(chunk_bytes, max_packet // 2)
+        finally:
+            connection.close()
+
+    def connection(self):
+        """返回当前线程的连接，断开时自动重连"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = pymysql.connect(database=self.database, **self.config)
+            self.local.connection = connection
+            with self.lock:
+                # 每个用户的写入线程结束后，关闭它留下的连接
+                for thread, old in self.connections:
+                    if not thread.is_alive():
+                        self.close_connection(old)
+                self.connections = [(thread, old)
+                                    for thread, old in self.connections
+                                    if thread.is_alive()]
+                self.connections.append(
+                    (threading.current_thread(), connection))
+        else:
+            connection.ping(reconnect=True)
+        return connection
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except pymysql.Error:
+            pass
+
+    def close(self):
+        with self.lock:
+            for _, connection in self.connections:
+                self.close_connection(connection)
+            self.connections = []
+        self.local = threading.local()
+
+    def write_user(self, user):
+        self.write('user', MYSQL_USER_COLUMNS, [mysql_user_row(user)])
+
+    def write_weibo(self, weibo_list):
+        rows = []
+        for w in weibo_list:
+            rows += mysql_weibo_rows(w)
+        self.write('weibo', MYSQL_WEIBO_COLUMNS, rows)
+
+    def write(self, table, columns, rows):
+        if not rows:
+            return
+        connection = self.connection()
+        try:
+            if self.load_data:
+                try:
+                    self.load(connection, table, columns, rows)
+                except pymysql.err.OperationalError as e:
+                    connection.rollback()
+                    logger.warning(u'LOAD DATA LOCAL INFILE不可用(%s)，改为INSERT写入', e)
+                    self.load_data = False
+                    self.upsert(connection, table, columns, rows)
+            else:
+                self.upsert(connection, table, columns, rows)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    def upsert(self, connection, table, columns, rows):
+        """按字节数分块执行多行INSERT ... ON DUPLICATE KEY UPDATE"""
+        prefix = 'INSERT INTO {} ({}) VALUES '.format(table, ', '.join(columns))
+        suffix = ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+            ['{0} = VALUES({0})'.format(c) for c in columns])
+        base_size = len(prefix) + len(suffix)
+        with connection.cursor() as cursor:
+            values = []
+            size = base_size
+            for row in rows:
+                value = connection.escape(row)
+                value_size = len(value.encode('utf-8')) + 1
+                if values and size + value_size > self.chunk_bytes:
+                    cursor.execute(prefix + ','.join(values) + suffix)
+                    values = []
+                    size = base_size
+                values.append(value)
+                size += value_size
+            cursor.execute(prefix + ','.join(values) + suffix)
+
+    def load(self, connection, table, columns, rows):
+        """把数据写入临时文件，再用一条LOAD DATA LOCAL INFILE导入"""
+        with tempfile.NamedTemporaryFile('w',
+                                         encoding='utf-8',
+                                         newline='\n',
+                                         suffix='.tsv',
+                                         delete=False) as f:
+            for row in rows:
+                f.write('\t'.join([tsv_value(v) for v in row]) + '\n')
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE {} '
+                    'CHARACTER SET utf8mb4 ({})'.format(
+                        table, ', '.join(columns)), (f.name, ))
+        finally:
+            os.remove(f.name)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+
+TEXT = 'text'
+COUNT = 'count'
+BOOL = 'bool'
+
+# 微博和用户信息中每个字段的类型，只有文本字段需要清理
+WEIBO_SCHEMA = {
+    'user_id': COUNT,
+    'screen_name': TEXT,
+    'id': COUNT,
+    'bid': TEXT,
+    'text': TEXT,
+    'article_url': TEXT,
+    'pics': TEXT,
+    'video_url': TEXT,
+    'location': TEXT,
+    'created_at': TEXT,
+    'source': TEXT,
+    'attitudes_count': COUNT,
+    'comments_count': COUNT,
+    'reposts_count': COUNT,
+    'topics': TEXT,
+    'at_users': TEXT,
+}
+USER_SCHEMA = {
+    'id': TEXT,
+    'screen_name': TEXT,
+    'gender': TEXT,
+    'birthday': TEXT,
+    'location': TEXT,
+    'education': TEXT,
+    'company': TEXT,
+    'registration_time': TEXT,
+    'sunshine': TEXT,
+    'statuses_count': COUNT,
+    'followers_count': COUNT,
+    'follow_count': COUNT,
+    'description': TEXT,
+    'profile_url': TEXT,
+    'profile_image_url': TEXT,
+    'avatar_hd': TEXT,
+    'urank': COUNT,
+    'mbrank': COUNT,
+    'verified': BOOL,
+    'verified_type': COUNT,
+    'verified_reason': TEXT,
+}
+WEIBO_TEXT_FIELDS = tuple(k for k, v in WEIBO_SCHEMA.items() if v == TEXT)
+USER_TEXT_FIELDS = tuple(k for k, v in USER_SCHEMA.items() if v == TEXT)
+
+SURROGATES = re.compile(u'[\ud800-\udfff]')
+
+
+def clean_text(value):
+    """去掉零宽空格和无法以utf-8保存的孤立代理字符，与终端编码无关"""
+    value = value.replace(u'\u200b', '')
+    if not value.isascii():
+        try:
+            value.encode('utf-8')
+        except UnicodeEncodeError:
+            value = SURROGATES.sub('', value)
+    return value
+
+
+def normalize(info, text_fields):
+    """就地清理info中的文本字段"""
+    for k in text_fields:
+        v = info.get(k)
+        if v.__class__ is str:
+            info[k] = clean_text(v)
+    return info
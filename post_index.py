@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import heapq
+import os
+from array import array
+from bisect import bisect_left
+
+
+class IdSet(object):
+    """微博id集合，用于判断某条微博是否已处理过
+
+    默认用set保存，查询和插入都是O(1)。compact为True时，大部分id保存在有序的
+    array('q')里，每个id只占8字节，新加入的id先放在set里，攒够一批后再归并，
+    批大小随集合增长，插入的均摊代价保持不变，查询为一次二分查找，
+    适合几十万条以上微博的超长时间线
+    """
+    def __init__(self, ids=(), compact=False, batch_size=4096):
+        self.compact = compact
+        self.batch_size = batch_size
+        self.recent = set()
+        self.sorted_ids = array('q')
+        self.update(ids)
+
+    def __contains__(self, weibo_id):
+        if weibo_id in self.recent:
+            return True
+        i = bisect_left(self.sorted_ids, weibo_id)
+        return i < len(self.sorted_ids) and self.sorted_ids[i] == weibo_id
+
+    def __len__(self):
+        return len(self.recent) + len(self.sorted_ids)
+
+    def __iter__(self):
+        for weibo_id in self.sorted_ids:
+            yield weibo_id
+        for weibo_id in self.recent:
+            yield weibo_id
+
+    def add(self, weibo_id):
+        """加入一个id，id已存在时返回False"""
+        if weibo_id in self:
+            return False
+        self.recent.add(weibo_id)
+        self.merge()
+        return True
+
+    def update(self, ids):
+        """批量加入id，比逐个add快，适合从文件加载已有的id"""
+        ids = set(ids)
+        ids.difference_update(self.recent)
+        if self.sorted_ids:
+            ids = [weibo_id for weibo_id in ids if weibo_id not in self]
+        self.recent.update(ids)
+        self.merge()
+
+    def merge(self):
+        """set中攒够一批id后归并到有序数组中"""
+        if self.compact and len(self.recent) >= max(
+                self.batch_size,
+                len(self.sorted_ids) // 8):
+            self.sorted_ids = array(
+                'q', heapq.merge(self.sorted_ids, sorted(self.recent)))
+            self.recent = set()
+
+
+class PostIndex(object):
+    """持久化的已爬取微博id索引，索引文件只追加不重写
+
+    文件每行为一个已写入的微博id；每次完整爬取结束后追加一行
+    "complete<TAB>最新微博id<TAB>发布时间"，记录已完整爬取到的最新微博
+    """
+    def __init__(self, path, compact=False):
+        self.path = path
+        self.ids = IdSet(compact=compact)
+        self.newest_id = 0  # 已完整爬取到的最新微博id，比它早的微博都已爬取过
+        self.newest_created_at = ''  # 已完整爬取到的最新微博发布时间
+        self.max_id = 0  # 索引中最新的微博id，爬取中断时可能大于newest_id
+        self.max_created_at = ''
+        if os.path.isfile(path):
+            ids = []
+            with codecs.open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    info = line.rstrip('\n').split('\t')
+                    if info[0] == 'complete' and len(info) > 2:
+                        self.newest_id = int(info[1])
+                        self.newest_created_at = info[2]
+                    elif info[0].isdigit():
+                        ids.append(int(info[0]))
+            self.ids.update(ids)
+        self.max_id = self.newest_id
+        self.max_created_at = self.newest_created_at
+
+    def __contains__(self, weibo_id):
+        return weibo_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def write_lines(self, lines):
+        file_dir = os.path.dirname(self.path)
+        if not os.path.isdir(file_dir):
+            os.makedirs(file_dir, exist_ok=True)
+        with codecs.open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+
+    def add(self, weibo_list):
+        """将已写入的微博加入索引"""
+        lines = []
+        for w in weibo_list:
+            if self.ids.add(w['id']):
+                lines.append(u'%d\n' % w['id'])
+            if w['id'] > self.max_id:
+                self.max_id = w['id']
+                self.max_created_at = w['created_at']
+        if lines:
+            self.write_lines(lines)
+
+    def complete(self):
+        """标记本次爬取已完整结束，下次增量爬取到newest_id即可停止"""
+        if self.max_id > self.newest_id:
+            self.newest_id = self.max_id
+            self.newest_created_at = self.max_created_at
+            self.write_lines([
+                u'complete\t%d\t%s\n' %
+                (self.newest_id, self.newest_created_at)
+            ])
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+
+from normalize import USER_SCHEMA, WEIBO_SCHEMA
+
+# 一批微博以tuple的形式交给所有写入方式共用，记录在交出前已处理完毕，之后只读。
+# 各写入方式通过下面的函数生成自己需要的行或属性，不修改也不复制共享的记录
+
+# csv中微博的列，与Weibo.get_result_headers的表头一一对应
+CSV_FIELDS = ('id', 'bid', 'text', 'article_url', 'pics', 'video_url',
+              'location', 'created_at', 'source', 'attitudes_count',
+              'comments_count', 'reposts_count', 'topics', 'at_users')
+MYSQL_USER_COLUMNS = tuple(USER_SCHEMA)
+MYSQL_WEIBO_COLUMNS = tuple(WEIBO_SCHEMA) + ('retweet_id', )
+DYNAMO_USER_ATTRIBUTES = tuple(k for k in USER_SCHEMA if k != 'id')
+DYNAMO_WEIBO_ATTRIBUTES = ('screen_name', 'text', 'article_url', 'topics',
+                           'at_users', 'pics', 'video_url', 'location',
+                           'created_at', 'source', 'attitudes_count',
+                           'comments_count', 'reposts_count')
+MISSING = object()  # 记录中未设置的字段
+
+
+class Record(object):
+    """字段固定的记录，用__slots__保存，没有每条记录一个字典的开销
+
+    支持w['id']、w.get('retweet')、'retweet' in w等字典式访问，爬虫、打印、
+    下载和各写入方式都直接使用记录；只有写json和MongoDB时才用to_dict转换
+    """
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return [k for k in self.__slots__ if hasattr(self, k)]
+
+    def values(self):
+        return [getattr(self, k) for k in self.keys()]
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.keys()]
+
+    def to_dict(self):
+        """按字段顺序转换为字典，嵌套的记录一并转换"""
+        info = {}
+        for k in self.__slots__:
+            v = getattr(self, k, MISSING)
+            if v is not MISSING:
+                info[k] = v.to_dict() if isinstance(v, Record) else v
+        return info
+
+    @classmethod
+    def from_dict(cls, info):
+        return cls(**info)
+
+    def __copy__(self):
+        return self.__class__(**dict(self.items()))
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return self.items() == other.items()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % item for item in self.items()))
+
+
+class UserRecord(Record):
+    __slots__ = tuple(USER_SCHEMA)
+
+
+class WeiboRecord(Record):
+    """一条微博，转发微博的源微博保存在retweet中"""
+    __slots__ = tuple(WEIBO_SCHEMA) + ('retweet', )
+
+    @classmethod
+    def from_dict(cls, info):
+        weibo = cls(**info)
+        if isinstance(info.get('retweet'), dict):
+            weibo.retweet = cls(**info['retweet'])
+        return weibo
+
+
+def csv_row(w, filter):
+    """csv的一行，filter为0时加上是否原创和源微博信息"""
+    row = [w[k] for k in CSV_FIELDS]
+    if not filter:
+        retweet = w.get('retweet')
+        if retweet:
+            row.append(False)
+            row.append(retweet['user_id'])
+            row.append(retweet['screen_name'])
+            row.extend([retweet[k] for k in CSV_FIELDS])
+        else:
+            row.append(True)
+    return row
+
+
+def mysql_user_row(user):
+    return [user.get(c) for c in MYSQL_USER_COLUMNS]
+
+
+def mysql_weibo_rows(w):
+    """weibo表的行，转发微博的源微博作为单独一行，retweet_id为源微博id"""
+    retweet = w.get('retweet')
+    if not retweet:
+        return [[w.get(c) for c in MYSQL_WEIBO_COLUMNS[:-1]] + ['']]
+    return [[retweet.get(c, '') for c in MYSQL_WEIBO_COLUMNS],
+            [w.get(c) for c in MYSQL_WEIBO_COLUMNS[:-1]] + [retweet['id']]]
+
+
+def dynamo_user_attributes(user):
+    return {k: user[k] for k in DYNAMO_USER_ATTRIBUTES}
+
+
+def dynamo_weibo_attributes(w):
+    attributes = {k: w[k] for k in DYNAMO_WEIBO_ATTRIBUTES}
+    attributes['user_id'] = w['user_id'] or None  # 用户已注销时为''
+    return attributes
+
+
+def document(info):
+    """写json和MongoDB时使用的字典，已经是字典的(如从json文件读出的)原样返回"""
+    return info.to_dict() if isinstance(info, Record) else info
+
+
+def record_size(record):
+    """记录大约占用的字节数，包括各字段的值和转发的源微博"""
+    size = sys.getsizeof(record)
+    for v in record.values():
+        size += record_size(v) if isinstance(v, Record) else sys.getsizeof(v)
+    return size
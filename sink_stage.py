@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+import logging
+import queue
+import threading
+import time
+
+from records import document
+
+logger = logging.getLogger('weibo')
+
+RETRY_DELAY = 1  # 第一次重试前等待的秒数，之后每次加倍
+
+
+class SinkStage(object):
+    """把每批微博同时交给各写入方式，每种写入方式有自己的有界队列和线程
+
+    爬虫线程调用put后立即继续爬取，只有某个队列已满时才会等待该写入方式，
+    慢的写入方式(如DynamoDB限流、Google Drive上传)不会让爬取停下来。
+    写入出错时按RETRY_DELAY成倍退避重试retries次，仍失败的微博追加到
+    retry_log中，不影响其他写入方式。一批微博在所有写入方式都处理完后
+    调用on_done(batch, ok)，ok表示是否全部写入成功，回调按顺序逐个执行
+    """
+    def __init__(self,
+                 sinks,
+                 queue_size=4,
+                 retries=3,
+                 retry_log=None,
+                 on_done=None):
+        self.retries = retries
+        self.retry_log = retry_log
+        self.on_done = on_done
+        self.lock = threading.Lock()
+        self.failed = 0  # 最终写入失败的次数，每种写入方式的每批计一次
+        self.workers = []
+        for name, write in sinks:
+            q = queue.Queue(maxsize=queue_size)
+            thread = threading.Thread(target=self.work,
+                                      args=(name, write, q),
+                                      name='sink-' + name,
+                                      daemon=True)
+            thread.start()
+            self.workers.append((q, thread))
+
+    def put(self, batch):
+        """把一批微博交给所有写入方式，只在某个队列已满时等待"""
+        if not self.workers:
+            self.finish(batch, [1, True], True)
+            return
+        state = [len(self.workers), True]  # 还未处理完的写入方式数，是否全部成功
+        for q, _ in self.workers:
+            q.put((batch, state))
+
+    def work(self, name, write, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            batch, state = item
+            ok = self.write(name, write, batch)
+            try:
+                self.finish(batch, state, ok)
+            except Exception as e:  # 线程不能退出，否则队列满后爬虫会一直等待
+                logger.exception(e)
+
+    def write(self, name, write, batch):
+        """写入一批微博，出错时退避重试，返回是否写入成功"""
+        for attempt in range(self.retries + 1):
+            try:
+                write(batch)
+                return True
+            except Exception as e:
+                logger.exception(e)
+                error = e
+                if attempt < self.retries:
+                    delay = RETRY_DELAY * 2**attempt
+                    logger.warning(u'%s写入失败，%g秒后第%d次重试', name, delay,
+                                   attempt + 1)
+                    time.sleep(delay)
+        self.log_failure(name, batch, error)
+        return False
+
+    def log_failure(self, name, batch, error):
+        """把写入失败的微博追加到retry_log，每行一条，可据此重新写入"""
+        logger.warning(u'%d条微博%s写入失败，已记录到%s', len(batch), name,
+                       self.retry_log)
+        with self.lock:
+            self.failed += 1
+            if not self.retry_log:
+                return
+            with codecs.open(self.retry_log, 'a', encoding='utf-8') as f:
+                for w in batch:
+                    f.write(
+                        json.dumps(
+                            {
+                                'sink': name,
+                                'error': str(error),
+                                'weibo': document(w)
+                            },
+                            ensure_ascii=False) + '\n')
+
+    def finish(self, batch, state, ok):
+        with self.lock:
+            state[0] -= 1
+            state[1] = state[1] and ok
+            if not state[0] and self.on_done is not None:
+                self.on_done(batch, state[1])
+
+    def close(self):
+        """等待队列中的微博全部写完，然后结束各线程"""
+        for q, _ in self.workers:
+            q.put(None)
+        for _, thread in self.workers:
+            thread.join()
+        self.workers = []
@@ -9,17 +9,31 @@ import logging
 import logging.config
 import math
 import os
-import random
 import sys
+import threading
 import warnings
 from collections import OrderedDict
-from datetime import date, datetime, timedelta
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 
 import requests
-from lxml import etree
 from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+from cache import WeiboCache
+from csv_writer import CsvWriter
+from dates import (START_DATE_FORMAT, beijing_now, format_datetime,
+                   is_before, parse_since_date, standardize_date)
+from downloader import DownloadPool
+from extractor import (LayoutChanged, PageNotReady, VisitorPage,
+                       extract_body, extract_status)
+from jsonl import JsonLinesWriter
+from limiter import THROTTLE_STATUS_CODES, RateLimiter
+from normalize import USER_TEXT_FIELDS, WEIBO_TEXT_FIELDS, normalize
+from post_index import IdSet, PostIndex
+from records import UserRecord, WeiboRecord, document, record_size
+from sink_stage import SinkStage
 
 warnings.filterwarnings("ignore")
 
@@ -28,6 +42,13 @@ logging_path = os.path.split(
 logging.config.fileConfig(logging_path)
 logger = logging.getLogger('weibo')
 
+NO_CONTENT_MSG = u'这里还没有内容'  # 时间线或搜索结果到头时接口返回的msg
+
+# get_one_page的返回值
+PAGE_DONE = 'done'  # 本页已处理完，继续下一页
+PAGE_END = 'end'  # 已到since_date、以前爬取过的微博或时间线末尾
+PAGE_FAILED = 'failed'  # 本页获取失败或有微博解析出错，继续下一页
+
 
 class Weibo(object):
     def __init__(self, config):
@@ -37,9 +58,9 @@ class Weibo(object):
             'filter']  # 取值范围为0、1,程序默认值为0,代表要爬取用户的全部微博,1代表只爬取用户的原创微博
         since_date = config['since_date']
         if isinstance(since_date, int):
-            since_date = date.today() - timedelta(since_date)
+            since_date = beijing_now().date() - timedelta(since_date)
         since_date = str(since_date)
-        self.since_date = since_date  # 起始时间，即爬取发布日期从该值到现在的微博，形式为yyyy-mm-dd
+        self.since_date = since_date  # 起始时间，即爬取发布时间从该值到现在的微博，形式为yyyy-mm-dd或yyyy-mm-dd HH:MM:SS
         self.start_page = config.get('start_page',
                                      1)  # 开始爬的页，如果中途被限制而结束可以用此定义开始页码
         self.write_mode = config[
@@ -54,10 +75,36 @@ class Weibo(object):
             'retweet_video_download']  # 取值范围为0、1, 0代表不下载转发微博视频,1代表下载
         self.result_dir_name = config.get(
             'result_dir_name', 0)  # 结果目录名，取值为0或1，决定结果文件存储在用户昵称文件夹里还是用户id文件夹里
+        self.full_crawl = config.get(
+            'full_crawl', 0)  # 取值为0或1，0代表增量爬取，遇到以前爬过的微博即停止，1代表强制重新爬取全部微博
+        self.csv_update = config.get(
+            'csv_update', 0)  # 取值为0或1，0代表csv中已有的微博不再写入，1代表用新爬取的点赞数等信息更新csv中已有的微博
+        self.buffer_count = config.get(
+            'buffer_count', 200)  # 内存中待写入的微博达到该条数时写入并释放，为0时不按条数限制
+        self.buffer_bytes = config.get(
+            'buffer_bytes', 32 * 1024 * 1024)  # 待写入的微博约占该字节数时写入并释放，为0时不按大小限制
+        self.sink_queue_size = config.get(
+            'sink_queue_size', 4)  # 每种写入方式最多排队的批数，队列满时爬取才会等待该写入方式
+        self.sink_retries = config.get('sink_retries',
+                                       3)  # 写入出错时的重试次数，仍失败的微博记录到retry文件中
         cookie = config.get('cookie')  # 微博cookie，可填可不填
         user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/86.0.4240.111 Safari/537.36'
         self.headers = {'User_Agent': user_agent, 'Cookie': cookie}
+        self.session = self.get_session()  # 所有请求共用的HTTP会话，复用长连接
+        self.download_pool = DownloadPool(config.get(
+            'download_threads', 8))  # 图片/视频并发下载线程池，默认最多8个下载线程
+        self.download_lock = threading.Lock()  # 多线程写not_downloaded.txt时加锁
+        self.user_threads = config.get('user_threads',
+                                       1)  # 同时爬取的用户数，默认为1，即逐个爬取
+        self.rate_limiter = RateLimiter(
+            config.get('request_rate', 1), max_rate=config.get(
+                'max_request_rate'))  # 所有用户共享的请求速率预算，默认初始平均每秒1个请求，请求正常时最高提速到2倍
+        self.write_lock = threading.Lock()  # 多个用户同时爬取时，写共享文件加锁
+        self.weibo_cache = self.get_weibo_cache(config.get(
+            'cache_days', 1))  # 长微博缓存的有效天数，默认为1天，为0时不使用缓存
         self.mysql_config = config.get('mysql_config')  # MySQL数据库连接配置，可以不填
+        self.mysql_sink = self.get_mysql_sink(config)  # 启动时建好MySQL库和表
+        self.mongo_sink = self.get_mongo_sink()  # 启动时建好MongoDB索引
         user_id_list = config['user_id_list']
         query_list = config.get('query_list') or []
         if isinstance(query_list, str):
@@ -78,12 +125,19 @@ class Weibo(object):
             } for user_id in user_id_list]
         self.user_config_list = user_config_list  # 要爬取的微博用户的user_config列表
         self.user_config = {}  # 用户配置,包含用户id和since_date
-        self.start_date = ''  # 获取用户第一条微博时的日期
+        self.start_date = ''  # 获取用户第一条微博时的时间
+        self.since_cutoff = ''  # 本用户的起始时间，形式为yyyy-mm-dd HH:MM:SS
         self.query = ''
         self.user = {}  # 存储目标微博用户信息
         self.got_count = 0  # 存储爬取到的微博数
-        self.weibo = []  # 存储爬取到的所有微博信息
-        self.weibo_id_list = []  # 存储爬取到的所有微博id
+        self.page_count = 0  # 当前用户的微博页数
+        self.weibo = []  # 存储爬取到但还未写入的微博信息，写入后即释放
+        self.weibo_bytes = 0  # self.weibo中的微博大约占用的字节数
+        self.weibo_id_list = IdSet(compact=True)  # 存储爬取到的所有微博id
+        self.post_index = None  # 以前运行时已爬取的微博id索引
+        self.jsonl_writer = None  # 当前用户的json lines结果文件
+        self.csv_writer = None  # 当前用户的csv结果文件，整个爬取过程保持打开
+        self.sink_stage = None  # 当前用户的写入线程，爬取时各写入方式在后台写入
 
     def validate_config(self, config):
         """验证配置是否正确"""
@@ -97,6 +151,39 @@ class Weibo(object):
             if config[argument] != 0 and config[argument] != 1:
                 logger.warning(u'%s值应为0或1,请重新输入', config[argument])
                 sys.exit()
+        for argument in ['full_crawl', 'csv_update', 'mysql_load_data']:
+            if config.get(argument, 0) not in (0, 1):
+                logger.warning(u'%s值应为0或1,请重新输入', argument)
+                sys.exit()
+
+        # 验证user_threads、download_threads、request_rate
+        for argument in ['user_threads', 'download_threads']:
+            value = config.get(argument, 1)
+            if not isinstance(value, int) or value < 1:
+                logger.warning(u'%s值应为正整数,请重新输入', argument)
+                sys.exit()
+        cache_days = config.get('cache_days', 1)
+        if not isinstance(cache_days, (int, float)) or cache_days < 0:
+            logger.warning(u'cache_days值应为非负数,请重新输入')
+            sys.exit()
+        for argument in ['buffer_count', 'buffer_bytes', 'sink_retries']:
+            value = config.get(argument, 0)
+            if not isinstance(value, int) or value < 0:
+                logger.warning(u'%s值应为非负整数,请重新输入', argument)
+                sys.exit()
+        sink_queue_size = config.get('sink_queue_size', 1)
+        if not isinstance(sink_queue_size, int) or sink_queue_size < 1:
+            logger.warning(u'sink_queue_size值应为正整数,请重新输入')
+            sys.exit()
+        for argument in ['request_rate', 'max_request_rate']:
+            rate = config.get(argument, 1)
+            if not isinstance(rate, (int, float)) or rate <= 0:
+                logger.warning(u'%s值应为正数,请重新输入', argument)
+                sys.exit()
+        if config.get('max_request_rate') is not None and config[
+                'max_request_rate'] < config.get('request_rate', 1):
+            logger.warning(u'max_request_rate值不能小于request_rate,请重新输入')
+            sys.exit()
 
         # 验证since_date
         since_date = config['since_date']
@@ -113,13 +200,13 @@ class Weibo(object):
             sys.exit()
 
         # 验证write_mode
-        write_mode = ['csv', 'json', 'mongo', 'mysql']
+        write_mode = ['csv', 'json', 'jsonl', 'mongo', 'mysql']
         if not isinstance(config['write_mode'], list):
             sys.exit(u'write_mode值应为list类型')
         for mode in config['write_mode']:
             if mode not in write_mode:
                 logger.warning(
-                    u'%s为无效模式，请从csv、json、mongo和mysql中挑选一个或多个作为write_mode',
+                    u'%s为无效模式，请从csv、json、jsonl、mongo和mysql中挑选一个或多个作为write_mode',
                     mode)
                 sys.exit()
 
@@ -139,19 +226,52 @@ class Weibo(object):
 
     def is_date(self, since_date):
         """判断日期格式是否正确"""
-        try:
-            datetime.strptime(since_date, '%Y-%m-%d')
-            return True
-        except ValueError:
-            return False
+        return parse_since_date(since_date) is not None
+
+    def get_session(self):
+        """创建带连接池的HTTP会话，微博接口、详情页和图片视频下载共用"""
+        retry = Retry(total=5,
+                      backoff_factor=0.5,
+                      status_forcelist=[500, 502, 503, 504])
+        session = requests.Session()
+        session.verify = False
+        session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        # m.weibo.cn只有一个域名，少量长连接即可；图片和视频分布在多个CDN域名上，
+        # 需要缓存更多的连接池，每个域名也保留更多连接
+        api_adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=4,
+                                  max_retries=retry)
+        media_adapter = HTTPAdapter(pool_connections=20,
+                                    pool_maxsize=10,
+                                    max_retries=retry)
+        session.mount('https://m.weibo.cn', api_adapter)
+        session.mount('https://', media_adapter)
+        session.mount('http://', media_adapter)
+        return session
+
+    def get_weibo_cache(self, cache_days):
+        """创建长微博缓存，同一条原微博被多次转发或多次运行时不必重复请求详情页"""
+        if not cache_days:
+            return None
+        file_dir = os.path.split(
+            os.path.realpath(__file__))[0] + os.sep + 'weibo'
+        if not os.path.isdir(file_dir):
+            os.makedirs(file_dir, exist_ok=True)
+        return WeiboCache(file_dir + os.sep + '.long_weibo_cache.db',
+                          ttl=cache_days * 86400)
 
     def get_json(self, params):
-        """获取网页中json数据"""
+        """获取网页中json数据
+
+        HTTP 200不代表没有被限制，调用者检查返回的数据正常后再调用rate_limiter.succeeded()
+        """
         url = 'https://m.weibo.cn/api/container/getIndex?'
-        r = requests.get(url,
-                         params=params,
-                         headers=self.headers,
-                         verify=False)
+        for i in range(5):
+            self.rate_limiter.acquire()
+            r = self.session.get(url, params=params, headers=self.headers)
+            if r.status_code not in THROTTLE_STATUS_CODES:
+                break
+            self.rate_limiter.throttled()
         return r.json()
 
     def get_weibo_json(self, page):
@@ -164,15 +284,28 @@ class Weibo(object):
             'containerid': '107603' + str(self.user_config['user_id'])
         }
         params['page'] = page
-        js = self.get_json(params)
+        for i in range(3):
+            js = self.get_json(params)
+            if js['ok'] and js.get('data', {}).get('cards'):
+                self.rate_limiter.succeeded()
+                break
+            if self.is_timeline_end(js, page):
+                break
+            self.rate_limiter.throttled()  # 其他空数据多半是被限制了，退避后重试
         return js
 
+    def is_timeline_end(self, js, page):
+        """ok为0或没有微博的返回是否表示时间线或搜索结果已到头，而不是被限制"""
+        if page >= self.page_count:
+            return True
+        return NO_CONTENT_MSG in (js.get('msg') or '')
+
     def user_to_csv(self):
         """将爬取到的用户信息写入csv文件"""
         file_dir = os.path.split(
             os.path.realpath(__file__))[0] + os.sep + 'weibo'
         if not os.path.isdir(file_dir):
-            os.makedirs(file_dir)
+            os.makedirs(file_dir, exist_ok=True)
         file_path = file_dir + os.sep + 'users.csv'
         result_headers = [
             '用户id', '昵称', '性别', '生日', '所在地', '学习经历', '公司', '注册时间', '阳光信用',
@@ -183,56 +316,21 @@ class Weibo(object):
             v.encode('utf-8') if 'unicode' in str(type(v)) else v
             for v in self.user.values()
         ]]
-        self.csv_helper(result_headers, result_data, file_path)
+        with self.write_lock:  # users.csv由所有用户共用
+            self.csv_helper(result_headers, result_data, file_path)
 
     def user_to_mongodb(self):
         """将爬取的用户信息写入MongoDB数据库"""
-        user_list = [self.user]
-        self.info_to_mongodb('user', user_list)
+        self.info_to_mongodb('user', [self.user])
         logger.info(u'%s信息写入MongoDB数据库完毕', self.user['screen_name'])
 
     def user_to_mysql(self):
         """将爬取的用户信息写入MySQL数据库"""
-        mysql_config = {
-            'host': 'localhost',
-            'port': 3306,
-            'user': 'root',
-            'password': '123456',
-            'charset': 'utf8mb4'
-        }
-        # 创建'weibo'数据库
-        create_database = """CREATE DATABASE IF NOT EXISTS weibo DEFAULT
-                         CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"""
-        self.mysql_create_database(mysql_config, create_database)
-        # 创建'user'表
-        create_table = """
-                CREATE TABLE IF NOT EXISTS user (
-                id varchar(20) NOT NULL,
-                screen_name varchar(30),
-                gender varchar(10),
-                statuses_count INT,
-                followers_count INT,
-                follow_count INT,
-                registration_time varchar(20),
-                sunshine varchar(20),
-                birthday varchar(40),
-                location varchar(200),
-                education varchar(200),
-                company varchar(200),
-                description varchar(400),
-                profile_url varchar(200),
-                profile_image_url varchar(200),
-                avatar_hd varchar(200),
-                urank INT,
-                mbrank INT,
-                verified BOOLEAN DEFAULT 0,
-                verified_type INT,
-                verified_reason varchar(140),
-                PRIMARY KEY (id)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
-        self.mysql_create_table(mysql_config, create_table)
-        self.mysql_insert(mysql_config, 'user', [self.user])
-        logger.info(u'%s信息写入MySQL数据库完毕', self.user['screen_name'])
+        try:
+            self.mysql_sink.write_user(self.user)
+            logger.info(u'%s信息写入MySQL数据库完毕', self.user['screen_name'])
+        except Exception as e:
+            logger.exception(e)
 
     def user_to_database(self):
         """将用户信息写入文件/数据库"""
@@ -247,8 +345,9 @@ class Weibo(object):
         params = {'containerid': '100505' + str(self.user_config['user_id'])}
         js = self.get_json(params)
         if js['ok']:
+            self.rate_limiter.succeeded()
             info = js['data']['userInfo']
-            user_info = OrderedDict()
+            user_info = UserRecord()
             user_info['id'] = self.user_config['user_id']
             user_info['screen_name'] = info.get('screen_name', '')
             user_info['gender'] = info.get('gender', '')
@@ -268,6 +367,7 @@ class Weibo(object):
                 user_info[i] = ''
             js = self.get_json(params)
             if js['ok']:
+                self.rate_limiter.succeeded()
                 cards = js['data']['cards']
                 if isinstance(cards, list) and len(cards) > 1:
                     card_list = cards[0]['card_group'] + cards[1]['card_group']
@@ -288,26 +388,42 @@ class Weibo(object):
             user_info['verified'] = info.get('verified', False)
             user_info['verified_type'] = info.get('verified_type', -1)
             user_info['verified_reason'] = info.get('verified_reason', '')
-            user = self.standardize_info(user_info)
+            user = normalize(user_info, USER_TEXT_FIELDS)
             self.user = user
             self.user_to_database()
             return user
 
     def get_long_weibo(self, id):
         """获取长微博"""
+        if self.weibo_cache:
+            weibo = self.weibo_cache.get(id)
+            if weibo:
+                return WeiboRecord.from_dict(weibo)
+        url = 'https://m.weibo.cn/detail/%s' % id
         for i in range(5):
-            url = 'https://m.weibo.cn/detail/%s' % id
-            html = requests.get(url, headers=self.headers, verify=False).text
-            html = html[html.find('"status":'):]
-            html = html[:html.rfind('"hotScheme"')]
-            html = html[:html.rfind(',')]
-            html = '{' + html + '}'
-            js = json.loads(html, strict=False)
-            weibo_info = js.get('status')
+            self.rate_limiter.acquire()
+            with self.session.get(url, headers=self.headers,
+                                  stream=True) as r:
+                if r.status_code in THROTTLE_STATUS_CODES:
+                    self.rate_limiter.throttled()
+                    continue
+                try:
+                    weibo_info = extract_status(
+                        r.iter_content(chunk_size=16 * 1024), r.encoding
+                        or 'utf-8')
+                except PageNotReady:
+                    self.rate_limiter.throttled()
+                    continue
+                except (LayoutChanged, VisitorPage) as e:
+                    logger.warning(u'无法解析长微博%s：%s', id, e)
+                    return
             if weibo_info:
+                self.rate_limiter.succeeded()
                 weibo = self.parse_weibo(weibo_info)
+                if self.weibo_cache:
+                    self.weibo_cache.set(id, document(weibo))
                 return weibo
-            sleep(random.randint(6, 10))
+            self.rate_limiter.throttled()
 
     def get_pics(self, weibo_info):
         """获取微博原始图片url"""
@@ -362,39 +478,80 @@ class Weibo(object):
             video_url_list += live_photo_list
         return ';'.join(video_url_list)
 
+    def stream_to_file(self, url, temp_path):
+        """将文件分块流式写入临时文件，临时文件已存在时通过Range请求续传"""
+        headers = dict(self.headers)
+        headers['Accept-Encoding'] = 'identity'  # 续传按原始字节偏移计算，不能压缩
+        if os.path.isfile(temp_path):
+            headers['Range'] = 'bytes=%d-' % os.path.getsize(temp_path)
+        with self.session.get(url,
+                              headers=headers,
+                              timeout=(5, 10),
+                              stream=True) as r:
+            if r.status_code == 416:  # 临时文件已下载完整
+                return
+            r.raise_for_status()
+            if r.status_code == 206:
+                mode = 'ab'
+                total_size = r.headers.get('Content-Range', '').split('/')[-1]
+            else:  # 服务器不支持续传，从头下载
+                mode = 'wb'
+                total_size = r.headers.get('Content-Length', '')
+            with open(temp_path, mode) as f:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+        if total_size.isdigit() and os.path.getsize(temp_path) != int(
+                total_size):
+            raise requests.exceptions.RequestException(
+                u'%s下载不完整，将续传' % url)
+
+    def is_complete_file(self, url, file_path):
+        """根据文件结尾判断jpg/png图片是否完整"""
+        if url.endswith(('jpg', 'jpeg')):
+            trailer = b'\xff\xd9'
+        elif url.endswith('png'):
+            trailer = b'\xaeB`\x82'
+        else:
+            return True
+        with open(file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < len(trailer):
+                return False
+            f.seek(-len(trailer), os.SEEK_END)
+            return f.read() == trailer
+
     def download_one_file(self, url, file_path, type, weibo_id):
         """下载单个文件(图片/视频)"""
         try:
             if not os.path.isfile(file_path):
-                s = requests.Session()
-                s.mount(url, HTTPAdapter(max_retries=5))
-                flag = True
+                temp_path = file_path + '.part'
                 try_count = 0
-                while flag and try_count < 5:
-                    flag = False
-                    downloaded = s.get(url,
-                                       headers=self.headers,
-                                       timeout=(5, 10),
-                                       verify=False)
+                while True:
                     try_count += 1
-                    if (url.endswith(('jpg', 'jpeg'))
-                            and not downloaded.content.endswith(b'\xff\xd9')
-                        ) or (url.endswith('png') and
-                              not downloaded.content.endswith(b'\xaeB`\x82')):
-                        flag = True
-                with open(file_path, 'wb') as f:
-                    f.write(downloaded.content)
+                    try:
+                        self.stream_to_file(url, temp_path)
+                    except requests.exceptions.RequestException:
+                        if try_count >= 5:
+                            raise
+                        continue
+                    if self.is_complete_file(url,
+                                             temp_path) or try_count >= 5:
+                        break
+                    os.remove(temp_path)  # 图片结尾损坏，删除后重新下载
+                os.replace(temp_path, file_path)  # 下载完成后再重命名，不会留下半个文件
         except Exception as e:
             error_file = self.get_filepath(
                 type) + os.sep + 'not_downloaded.txt'
-            with open(error_file, 'ab') as f:
-                url = str(weibo_id) + ':' + file_path + ':' + url + '\n'
-                f.write(url.encode(sys.stdout.encoding))
+            with self.download_lock:
+                with open(error_file, 'ab') as f:
+                    url = str(weibo_id) + ':' + file_path + ':' + url + '\n'
+                    f.write(url.encode(sys.stdout.encoding))
             logger.exception(e)
 
     def handle_download(self, file_type, file_dir, urls, w):
-        """处理下载相关操作"""
-        file_prefix = w['created_at'][:11].replace('-', '') + '_' + str(
+        """处理下载相关操作，返回待下载任务列表，每个任务为download_one_file的参数"""
+        jobs = []
+        file_prefix = w['created_at'][:10].replace('-', '') + '_' + str(
             w['id'])
         if file_type == 'img':
             if ',' in urls:
@@ -407,7 +564,7 @@ class Weibo(object):
                         file_suffix = url[index:]
                     file_name = file_prefix + '_' + str(i + 1) + file_suffix
                     file_path = file_dir + os.sep + file_name
-                    self.download_one_file(url, file_path, file_type, w['id'])
+                    jobs.append((url, file_path, file_type, w['id']))
             else:
                 index = urls.rfind('.')
                 if len(urls) - index > 5:
@@ -416,7 +573,7 @@ class Weibo(object):
                     file_suffix = urls[index:]
                 file_name = file_prefix + file_suffix
                 file_path = file_dir + os.sep + file_name
-                self.download_one_file(urls, file_path, file_type, w['id'])
+                jobs.append((urls, file_path, file_type, w['id']))
         else:
             file_suffix = '.mp4'
             if ';' in urls:
@@ -426,15 +583,16 @@ class Weibo(object):
                 for i, url in enumerate(url_list):
                     file_name = file_prefix + '_' + str(i + 1) + file_suffix
                     file_path = file_dir + os.sep + file_name
-                    self.download_one_file(url, file_path, file_type, w['id'])
+                    jobs.append((url, file_path, file_type, w['id']))
             else:
                 if urls.endswith('.mov'):
                     file_suffix = '.mov'
                 file_name = file_prefix + file_suffix
                 file_path = file_dir + os.sep + file_name
-                self.download_one_file(urls, file_path, file_type, w['id'])
+                jobs.append((urls, file_path, file_type, w['id']))
+        return jobs
 
-    def download_files(self, file_type, weibo_type, wrote_count):
+    def download_files(self, file_type, weibo_type, weibo_list):
         """下载文件(图片/视频)"""
         try:
             describe = ''
@@ -452,67 +610,30 @@ class Weibo(object):
             file_dir = self.get_filepath(file_type)
             file_dir = file_dir + os.sep + describe
             if not os.path.isdir(file_dir):
-                os.makedirs(file_dir)
-            for w in tqdm(self.weibo[wrote_count:], desc='Download progress'):
+                os.makedirs(file_dir, exist_ok=True)
+            jobs = []
+            handled_ids = IdSet()  # 同一条原微博可能被多次转发，只下载一次
+            for w in weibo_list:
                 if weibo_type == 'retweet':
                     if w.get('retweet'):
                         w = w['retweet']
                     else:
                         continue
-                if w.get(key):
-                    self.handle_download(file_type, file_dir, w.get(key), w)
+                if w.get(key) and handled_ids.add(w['id']):
+                    jobs += self.handle_download(file_type, file_dir,
+                                                 w.get(key), w)
+            futures = [
+                self.download_pool.submit(job[0], self.download_one_file,
+                                          *job) for job in jobs
+            ]
+            with tqdm(total=len(futures), desc='Download progress') as pbar:
+                for _ in as_completed(futures):
+                    pbar.update(1)
             logger.info(u'%s下载完毕,保存路径:', describe)
             logger.info(file_dir)
         except Exception as e:
             logger.exception(e)
 
-    def get_location(self, selector):
-        """获取微博发布位置"""
-        location_icon = 'timeline_card_small_location_default.png'
-        span_list = selector.xpath('//span')
-        location = ''
-        for i, span in enumerate(span_list):
-            if span.xpath('img/@src'):
-                if location_icon in span.xpath('img/@src')[0]:
-                    location = span_list[i + 1].xpath('string(.)')
-                    break
-        return location
-
-    def get_article_url(self, selector):
-        """获取微博中头条文章的url"""
-        article_url = ''
-        text = selector.xpath('string(.)')
-        if text.startswith(u'发布了头条文章'):
-            url = selector.xpath('//a/@data-url')
-            if url and url[0].startswith('http://t.cn'):
-                article_url = url[0]
-        return article_url
-
-    def get_topics(self, selector):
-        """获取参与的微博话题"""
-        span_list = selector.xpath("//span[@class='surl-text']")
-        topics = ''
-        topic_list = []
-        for span in span_list:
-            text = span.xpath('string(.)')
-            if len(text) > 2 and text[0] == '#' and text[-1] == '#':
-                topic_list.append(text[1:-1])
-        if topic_list:
-            topics = ','.join(topic_list)
-        return topics
-
-    def get_at_users(self, selector):
-        """获取@用户"""
-        a_list = selector.xpath('//a')
-        at_users = ''
-        at_list = []
-        for a in a_list:
-            if '@' + a.xpath('@href')[0][3:] == a.xpath('string(.)'):
-                at_list.append(a.xpath('string(.)')[1:])
-        if at_list:
-            at_users = ','.join(at_list)
-        return at_users
-
     def string_to_int(self, string):
         """字符串转换为整数"""
         if isinstance(string, int):
@@ -523,39 +644,8 @@ class Weibo(object):
             string = int(string[:-1] + '0000')
         return int(string)
 
-    def standardize_date(self, created_at):
-        """标准化微博发布时间"""
-        if u'刚刚' in created_at:
-            created_at = datetime.now().strftime('%Y-%m-%d')
-        elif u'分钟' in created_at:
-            minute = created_at[:created_at.find(u'分钟')]
-            minute = timedelta(minutes=int(minute))
-            created_at = (datetime.now() - minute).strftime('%Y-%m-%d')
-        elif u'小时' in created_at:
-            hour = created_at[:created_at.find(u'小时')]
-            hour = timedelta(hours=int(hour))
-            created_at = (datetime.now() - hour).strftime('%Y-%m-%d')
-        elif u'昨天' in created_at:
-            day = timedelta(days=1)
-            created_at = (datetime.now() - day).strftime('%Y-%m-%d')
-        else:
-            created_at = created_at.replace('+0800 ', '')
-            temp = datetime.strptime(created_at, '%c')
-            created_at = datetime.strftime(temp, '%Y-%m-%d')
-        return created_at
-
-    def standardize_info(self, weibo):
-        """标准化信息，去除乱码"""
-        for k, v in weibo.items():
-            if 'bool' not in str(type(v)) and 'int' not in str(
-                    type(v)) and 'list' not in str(
-                        type(v)) and 'long' not in str(type(v)):
-                weibo[k] = v.replace(u'\u200b', '').encode(
-                    sys.stdout.encoding, 'ignore').decode(sys.stdout.encoding)
-        return weibo
-
     def parse_weibo(self, weibo_info):
-        weibo = OrderedDict()
+        weibo = WeiboRecord()
         if weibo_info['user']:
             weibo['user_id'] = weibo_info['user']['id']
             weibo['screen_name'] = weibo_info['user']['screen_name']
@@ -564,13 +654,13 @@ class Weibo(object):
             weibo['screen_name'] = ''
         weibo['id'] = int(weibo_info['id'])
         weibo['bid'] = weibo_info['bid']
-        text_body = weibo_info['text']
-        selector = etree.HTML(text_body)
-        weibo['text'] = etree.HTML(text_body).xpath('string(.)')
-        weibo['article_url'] = self.get_article_url(selector)
+        text, article_url, location, topics, at_users = extract_body(
+            weibo_info['text'])
+        weibo['text'] = text
+        weibo['article_url'] = article_url
         weibo['pics'] = self.get_pics(weibo_info)
         weibo['video_url'] = self.get_video_url(weibo_info)
-        weibo['location'] = self.get_location(selector)
+        weibo['location'] = location
         weibo['created_at'] = weibo_info['created_at']
         weibo['source'] = weibo_info['source']
         weibo['attitudes_count'] = self.string_to_int(
@@ -579,9 +669,9 @@ class Weibo(object):
             weibo_info.get('comments_count', 0))
         weibo['reposts_count'] = self.string_to_int(
             weibo_info.get('reposts_count', 0))
-        weibo['topics'] = self.get_topics(selector)
-        weibo['at_users'] = self.get_at_users(selector)
-        return self.standardize_info(weibo)
+        weibo['topics'] = topics
+        weibo['at_users'] = at_users
+        return normalize(weibo, WEIBO_TEXT_FIELDS)
 
     def print_user_info(self):
         """打印用户信息"""
@@ -635,41 +725,97 @@ class Weibo(object):
         self.print_one_weibo(weibo)
         logger.info('-' * 120)
 
-    def get_one_weibo(self, info):
-        """获取一条微博的全部信息"""
+    def is_long_weibo(self, weibo_info):
+        """判断微博是否需要到详情页获取全文"""
+        return True if weibo_info.get('pic_num') > 9 else weibo_info.get(
+            'isLongText')
+
+    def is_known_weibo(self, weibo_id):
+        """判断微博是否已在本次或以前的运行中爬取过"""
+        if weibo_id in self.weibo_id_list:
+            return True
+        return self.post_index is not None and (
+            weibo_id <= self.post_index.newest_id
+            or weibo_id in self.post_index)
+
+    def get_long_weibos(self, weibos):
+        """并发获取一页中所有长微博和长原微博的全文，返回微博id到长微博的字典
+
+        会被过滤或已爬取过的微博不必获取全文，它们的id对应None，
+        get_one_weibo直接使用微博列表中的内容
+        """
+        long_ids = []
+        skipped_ids = []
+        for w in weibos:
+            if w['card_type'] == 9:
+                weibo_info = w['mblog']
+                retweeted_status = weibo_info.get('retweeted_status')
+                is_retweet = retweeted_status and retweeted_status.get('id')
+                skip = (self.filter and is_retweet) or self.is_known_weibo(
+                    int(weibo_info['id']))  # 会被过滤或已爬取过的微博
+                ids = skipped_ids if skip else long_ids
+                if self.is_long_weibo(weibo_info):
+                    ids.append(weibo_info['id'])
+                if is_retweet and retweeted_status.get('isLongText'):
+                    ids.append(retweeted_status['id'])
+        long_ids = list(OrderedDict.fromkeys(long_ids))
+        long_weibos = dict.fromkeys(set(skipped_ids).difference(long_ids))
+        if not long_ids:
+            return long_weibos
+        # 详情页请求同样经过rate_limiter，并发只是让等待限速和网络响应的时间重叠
+        with ThreadPoolExecutor(max_workers=min(4, len(long_ids))) as executor:
+            long_weibos.update(
+                zip(long_ids, executor.map(self.try_get_long_weibo,
+                                           long_ids)))
+        return long_weibos
+
+    def try_get_long_weibo(self, id):
+        """获取长微博，出错时返回None，由调用者改用微博列表中的内容"""
+        try:
+            return self.get_long_weibo(id)
+        except Exception as e:
+            logger.exception(e)
+
+    def find_long_weibo(self, id, long_weibos):
+        """优先使用已并发获取的长微博，有意跳过的微博返回None"""
+        if long_weibos is not None and id in long_weibos:
+            weibo = long_weibos[id]
+            return copy.copy(weibo) if weibo else weibo
+        return self.get_long_weibo(id)
+
+    def get_one_weibo(self, info, long_weibos=None):
+        """获取一条微博的全部信息，long_weibos为get_long_weibos预先获取的长微博"""
         try:
             weibo_info = info['mblog']
             weibo_id = weibo_info['id']
             retweeted_status = weibo_info.get('retweeted_status')
-            is_long = True if weibo_info.get(
-                'pic_num') > 9 else weibo_info.get('isLongText')
+            is_long = self.is_long_weibo(weibo_info)
             if retweeted_status and retweeted_status.get('id'):  # 转发
                 retweet_id = retweeted_status.get('id')
                 is_long_retweet = retweeted_status.get('isLongText')
                 if is_long:
-                    weibo = self.get_long_weibo(weibo_id)
+                    weibo = self.find_long_weibo(weibo_id, long_weibos)
                     if not weibo:
                         weibo = self.parse_weibo(weibo_info)
                 else:
                     weibo = self.parse_weibo(weibo_info)
                 if is_long_retweet:
-                    retweet = self.get_long_weibo(retweet_id)
+                    retweet = self.find_long_weibo(retweet_id, long_weibos)
                     if not retweet:
                         retweet = self.parse_weibo(retweeted_status)
                 else:
                     retweet = self.parse_weibo(retweeted_status)
-                retweet['created_at'] = self.standardize_date(
+                retweet['created_at'] = standardize_date(
                     retweeted_status['created_at'])
                 weibo['retweet'] = retweet
             else:  # 原创
                 if is_long:
-                    weibo = self.get_long_weibo(weibo_id)
+                    weibo = self.find_long_weibo(weibo_id, long_weibos)
                     if not weibo:
                         weibo = self.parse_weibo(weibo_info)
                 else:
                     weibo = self.parse_weibo(weibo_info)
-            weibo['created_at'] = self.standardize_date(
-                weibo_info['created_at'])
+            weibo['created_at'] = standardize_date(weibo_info['created_at'])
             return weibo
         except Exception as e:
             logger.exception(e)
@@ -684,24 +830,38 @@ class Weibo(object):
             return False
 
     def get_one_page(self, page):
-        """获取一页的全部微博"""
+        """获取一页的全部微博，返回PAGE_DONE、PAGE_END或PAGE_FAILED"""
         try:
             js = self.get_weibo_json(page)
-            if js['ok']:
+            failed = False
+            if js['ok'] and js.get('data', {}).get('cards'):
                 weibos = js['data']['cards']
                 if self.query:
                     weibos = weibos[0]['card_group']
+                long_weibos = self.get_long_weibos(weibos)
                 for w in weibos:
                     if w['card_type'] == 9:
-                        wb = self.get_one_weibo(w)
-                        if wb:
+                        wb = self.get_one_weibo(w, long_weibos)
+                        if not wb:
+                            failed = True  # 解析出错的微博不能算作已爬取
+                        else:
                             if wb['id'] in self.weibo_id_list:
                                 continue
-                            created_at = datetime.strptime(
-                                wb['created_at'], '%Y-%m-%d')
-                            since_date = datetime.strptime(
-                                self.user_config['since_date'], '%Y-%m-%d')
-                            if created_at < since_date:
+                            if self.post_index is not None:
+                                if wb['id'] <= self.post_index.newest_id:
+                                    if self.is_pinned_weibo(w):
+                                        continue
+                                    logger.info(
+                                        u'{}已获取{}({})的第{}页微博，更早的微博已在{}之前爬取过{}'
+                                        .format(
+                                            '-' * 30, self.user['screen_name'],
+                                            self.user['id'], page,
+                                            self.post_index.newest_created_at,
+                                            '-' * 30))
+                                    return PAGE_END
+                                if wb['id'] in self.post_index:
+                                    continue  # 上次中断前已写入
+                            if is_before(wb['created_at'], self.since_cutoff):
                                 if self.is_pinned_weibo(w):
                                     continue
                                 else:
@@ -712,22 +872,28 @@ class Weibo(object):
                                             '包含"' + self.query +
                                             '"的' if self.query else '',
                                             '-' * 30))
-                                    return True
+                                    return PAGE_END
                             if (not self.filter) or (
                                     'retweet' not in wb.keys()):
                                 self.weibo.append(wb)
-                                self.weibo_id_list.append(wb['id'])
+                                self.weibo_bytes += record_size(wb)
+                                self.weibo_id_list.add(wb['id'])
                                 self.got_count += 1
                                 self.print_weibo(wb)
                             else:
                                 logger.info(u'正在过滤转发微博')
+            elif self.is_timeline_end(js, page):
+                return PAGE_END
             else:
-                return True
+                logger.warning(u'第%d页多次返回空数据，可能被限制，跳过该页', page)
+                return PAGE_FAILED
             logger.info(u'{}已获取{}({})的第{}页微博{}'.format(
                 '-' * 30, self.user['screen_name'], self.user['id'], page,
                 '-' * 30))
+            return PAGE_FAILED if failed else PAGE_DONE
         except Exception as e:
             logger.exception(e)
+            return PAGE_FAILED
 
     def get_page_count(self):
         """获取微博页数"""
@@ -748,28 +914,6 @@ class Weibo(object):
                 u'https://github.com/dataabc/weibo-crawler#3程序设置\n'
                 u'中的“设置cookie”部分设置cookie信息')
 
-    def get_write_info(self, wrote_count):
-        """获取要写入的微博信息"""
-        write_info = []
-        for w in self.weibo[wrote_count:]:
-            wb = OrderedDict()
-            for k, v in w.items():
-                if k not in ['user_id', 'screen_name', 'retweet']:
-                    if 'unicode' in str(type(v)):
-                        v = v.encode('utf-8')
-                    wb[k] = v
-            if not self.filter:
-                if w.get('retweet'):
-                    wb['is_original'] = False
-                    for k2, v2 in w['retweet'].items():
-                        if 'unicode' in str(type(v2)):
-                            v2 = v2.encode('utf-8')
-                        wb['retweet_' + k2] = v2
-                else:
-                    wb['is_original'] = True
-            write_info.append(wb)
-        return write_info
-
     def get_filepath(self, type):
         """获取结果文件路径"""
         try:
@@ -781,7 +925,7 @@ class Weibo(object):
             if type == 'img' or type == 'video':
                 file_dir = file_dir + os.sep + type
             if not os.path.isdir(file_dir):
-                os.makedirs(file_dir)
+                os.makedirs(file_dir, exist_ok=True)
             if type == 'img' or type == 'video':
                 return file_dir
             file_path = file_dir + os.sep + self.user_config[
@@ -802,13 +946,23 @@ class Weibo(object):
             result_headers = result_headers + result_headers2 + result_headers3
         return result_headers
 
-    def write_csv(self, wrote_count):
-        """将爬到的信息写入csv文件"""
-        write_info = self.get_write_info(wrote_count)
-        result_headers = self.get_result_headers()
-        result_data = [w.values() for w in write_info]
-        file_path = self.get_filepath('csv')
-        self.csv_helper(result_headers, result_data, file_path)
+    def write_csv(self, weibo_list):
+        """将爬到的信息写入csv文件，csv中已有的微博不重复写入"""
+        if self.csv_writer is None:
+            self.csv_writer = CsvWriter(self.get_filepath('csv'),
+                                        self.get_result_headers(),
+                                        self.filter, self.csv_update)
+        count = self.csv_writer.write(weibo_list)
+        logger.info(u'%d条微博写入csv文件完毕(新增%d条),保存路径:', len(weibo_list),
+                    count)
+        logger.info(self.csv_writer.path)
+
+    def close_writers(self):
+        """关闭当前用户的结果文件"""
+        if self.csv_writer is not None:
+            self.csv_writer.close()
+            self.csv_writer = None
+        self.jsonl_writer = None
 
     def csv_helper(self, headers, result_data, file_path):
         """将指定信息写入csv文件"""
@@ -829,204 +983,109 @@ class Weibo(object):
                 if is_first_write:
                     writer.writerows([headers])
                 writer.writerows(result_data)
-        if headers[0] == 'id':
-            logger.info(u'%d条微博写入csv文件完毕,保存路径:', self.got_count)
-        else:
-            logger.info(u'%s 信息写入csv文件完毕，保存路径:', self.user['screen_name'])
+        logger.info(u'%s 信息写入csv文件完毕，保存路径:', self.user['screen_name'])
         logger.info(file_path)
 
     def update_json_data(self, data, weibo_info):
         """更新要写入json结果文件中的数据，已经存在于json中的信息更新为最新值，不存在的信息添加到data中"""
-        data['user'] = self.user
+        data['user'] = document(self.user)
         if data.get('weibo'):
-            is_new = 1  # 待写入微博是否全部为新微博，即待写入微博与json中的数据不重复
-            for old in data['weibo']:
-                if weibo_info[-1]['id'] == old['id']:
-                    is_new = 0
-                    break
-            if is_new == 0:
-                for new in weibo_info:
-                    flag = 1
-                    for i, old in enumerate(data['weibo']):
-                        if new['id'] == old['id']:
-                            data['weibo'][i] = new
-                            flag = 0
-                            break
-                    if flag:
-                        data['weibo'].append(new)
-            else:
-                data['weibo'] += weibo_info
+            positions = {old['id']: i for i, old in enumerate(data['weibo'])}
+            for new in weibo_info:
+                new = document(new)
+                i = positions.get(new['id'])
+                if i is None:
+                    positions[new['id']] = len(data['weibo'])
+                    data['weibo'].append(new)
+                else:
+                    data['weibo'][i] = new
         else:
-            data['weibo'] = weibo_info
+            data['weibo'] = [document(w) for w in weibo_info]
         return data
 
-    def write_json(self, wrote_count):
+    def write_json(self, weibo_list):
         """将爬到的信息写入json文件"""
         data = {}
         path = self.get_filepath('json')
         if os.path.isfile(path):
             with codecs.open(path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-        weibo_info = self.weibo[wrote_count:]
-        data = self.update_json_data(data, weibo_info)
-        with codecs.open(path, 'w', encoding='utf-8') as f:
+        data = self.update_json_data(data, weibo_list)
+        # 先写临时文件再替换，写入出错时原文件保持完整，可以重试
+        with codecs.open(path + '.part', 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False)
-        logger.info(u'%d条微博写入json文件完毕,保存路径:', self.got_count)
+        os.replace(path + '.part', path)
+        logger.info(u'%d条微博写入json文件完毕,保存路径:', len(weibo_list))
         logger.info(path)
 
-    def info_to_mongodb(self, collection, info_list):
-        """将爬取的信息写入MongoDB数据库"""
+    def write_jsonl(self, weibo_list):
+        """将爬到的信息追加写入json lines文件，不读取和重写已有内容"""
+        if self.jsonl_writer is None:
+            self.jsonl_writer = JsonLinesWriter(self.get_filepath('jsonl'))
+        self.jsonl_writer.write(self.user, weibo_list)
+        logger.info(u'%d条微博写入json lines文件完毕,保存路径:', len(weibo_list))
+        logger.info(self.jsonl_writer.path)
+
+    def get_mongo_sink(self):
+        """连接MongoDB并在id上建唯一索引，所有用户和线程共用"""
+        if 'mongo' not in self.write_mode:
+            return None
         try:
             import pymongo
+            from mongo_sink import MongoSink
         except ImportError:
             logger.warning(
                 u'系统中可能没有安装pymongo库，请先运行 pip install pymongo ，再运行程序')
             sys.exit()
         try:
-            from pymongo import MongoClient
-
-            client = MongoClient()
-            db = client['weibo']
-            collection = db[collection]
-            if len(self.write_mode) > 1:
-                new_info_list = copy.deepcopy(info_list)
-            else:
-                new_info_list = info_list
-            for info in new_info_list:
-                if not collection.find_one({'id': info['id']}):
-                    collection.insert_one(info)
-                else:
-                    collection.update_one({'id': info['id']}, {'$set': info})
+            return MongoSink()
         except pymongo.errors.ServerSelectionTimeoutError:
             logger.warning(
                 u'系统中可能没有安装或启动MongoDB数据库，请先根据系统环境安装或启动MongoDB，再运行程序')
             sys.exit()
 
-    def weibo_to_mongodb(self, wrote_count):
-        """将爬取的微博信息写入MongoDB数据库"""
-        self.info_to_mongodb('weibo', self.weibo[wrote_count:])
-        logger.info(u'%d条微博写入MongoDB数据库完毕', self.got_count)
-
-    def mysql_create(self, connection, sql):
-        """创建MySQL数据库或表"""
+    def info_to_mongodb(self, collection, info_list):
+        """将爬取的信息写入MongoDB数据库"""
         try:
-            with connection.cursor() as cursor:
-                cursor.execute(sql)
-        finally:
-            connection.close()
+            self.mongo_sink.write(collection, info_list)
+        except Exception as e:
+            logger.exception(e)
 
-    def mysql_create_database(self, mysql_config, sql):
-        """创建MySQL数据库"""
+    def weibo_to_mongodb(self, weibo_list):
+        """将爬取的微博信息写入MongoDB数据库"""
+        self.mongo_sink.write('weibo', weibo_list)
+        logger.info(u'%d条微博写入MongoDB数据库完毕', len(weibo_list))
+
+    def get_mysql_sink(self, config):
+        """连接MySQL并建好库和表，所有用户和线程共用"""
+        if 'mysql' not in self.write_mode:
+            return None
         try:
             import pymysql
+            from mysql_sink import MySQLSink
         except ImportError:
             logger.warning(
                 u'系统中可能没有安装pymysql库，请先运行 pip install pymysql ，再运行程序')
             sys.exit()
         try:
-            if self.mysql_config:
-                mysql_config = self.mysql_config
-            connection = pymysql.connect(**mysql_config)
-            self.mysql_create(connection, sql)
+            return MySQLSink(self.mysql_config,
+                             load_data=config.get('mysql_load_data', 0))
         except pymysql.OperationalError:
             logger.warning(u'系统中可能没有安装或正确配置MySQL数据库，请先根据系统环境安装或配置MySQL，再运行程序')
             sys.exit()
 
-    def mysql_create_table(self, mysql_config, sql):
-        """创建MySQL表"""
-        import pymysql
-
-        if self.mysql_config:
-            mysql_config = self.mysql_config
-        mysql_config['db'] = 'weibo'
-        connection = pymysql.connect(**mysql_config)
-        self.mysql_create(connection, sql)
-
-    def mysql_insert(self, mysql_config, table, data_list):
-        """向MySQL表插入或更新数据"""
-        import pymysql
-
-        if len(data_list) > 0:
-            keys = ', '.join(data_list[0].keys())
-            values = ', '.join(['%s'] * len(data_list[0]))
-            if self.mysql_config:
-                mysql_config = self.mysql_config
-            mysql_config['db'] = 'weibo'
-            connection = pymysql.connect(**mysql_config)
-            cursor = connection.cursor()
-            sql = """INSERT INTO {table}({keys}) VALUES ({values}) ON
-                     DUPLICATE KEY UPDATE""".format(table=table,
-                                                    keys=keys,
-                                                    values=values)
-            update = ','.join([
-                ' {key} = values({key})'.format(key=key)
-                for key in data_list[0]
-            ])
-            sql += update
-            try:
-                cursor.executemany(
-                    sql, [tuple(data.values()) for data in data_list])
-                connection.commit()
-            except Exception as e:
-                connection.rollback()
-                logger.exception(e)
-            finally:
-                connection.close()
-
-    def weibo_to_mysql(self, wrote_count):
+    def weibo_to_mysql(self, weibo_list):
         """将爬取的微博信息写入MySQL数据库"""
-        mysql_config = {
-            'host': 'localhost',
-            'port': 3306,
-            'user': 'root',
-            'password': '123456',
-            'charset': 'utf8mb4'
-        }
-        # 创建'weibo'表
-        create_table = """
-                CREATE TABLE IF NOT EXISTS weibo (
-                id varchar(20) NOT NULL,
-                bid varchar(12) NOT NULL,
-                user_id varchar(20),
-                screen_name varchar(30),
-                text varchar(2000),
-                article_url varchar(100),
-                topics varchar(200),
-                at_users varchar(1000),
-                pics varchar(3000),
-                video_url varchar(1000),
-                location varchar(100),
-                created_at DATETIME,
-                source varchar(30),
-                attitudes_count INT,
-                comments_count INT,
-                reposts_count INT,
-                retweet_id varchar(20),
-                PRIMARY KEY (id)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
-        self.mysql_create_table(mysql_config, create_table)
-        weibo_list = []
-        retweet_list = []
-        if len(self.write_mode) > 1:
-            info_list = copy.deepcopy(self.weibo[wrote_count:])
-        else:
-            info_list = self.weibo[wrote_count:]
-        for w in info_list:
-            if 'retweet' in w:
-                w['retweet']['retweet_id'] = ''
-                retweet_list.append(w['retweet'])
-                w['retweet_id'] = w['retweet']['id']
-                del w['retweet']
-            else:
-                w['retweet_id'] = ''
-            weibo_list.append(w)
-        # 在'weibo'表中插入或更新微博数据
-        self.mysql_insert(mysql_config, 'weibo', retweet_list)
-        self.mysql_insert(mysql_config, 'weibo', weibo_list)
-        logger.info(u'%d条微博写入MySQL数据库完毕', self.got_count)
+        self.mysql_sink.write_weibo(weibo_list)
+        logger.info(u'%d条微博写入MySQL数据库完毕', len(weibo_list))
 
     def update_user_config_file(self, user_config_file_path):
         """更新用户配置文件"""
+        with self.write_lock:  # 多个用户同时爬取时，避免同时改写配置文件
+            self.rewrite_user_config_file(user_config_file_path)
+
+    def rewrite_user_config_file(self, user_config_file_path):
+        """将当前用户的爬取日期写入用户配置文件"""
         with open(user_config_file_path, 'rb') as f:
             try:
                 lines = f.read().splitlines()
@@ -1051,64 +1110,141 @@ class Weibo(object):
         with codecs.open(user_config_file_path, 'w', encoding='utf-8') as f:
             f.write('\n'.join(lines))
 
-    def write_data(self, wrote_count):
-        """将爬到的信息写入文件或数据库"""
-        if self.got_count > wrote_count:
-            if 'csv' in self.write_mode:
-                self.write_csv(wrote_count)
-            if 'json' in self.write_mode:
-                self.write_json(wrote_count)
-            if 'mysql' in self.write_mode:
-                self.weibo_to_mysql(wrote_count)
-            if 'mongo' in self.write_mode:
-                self.weibo_to_mongodb(wrote_count)
-            if self.original_pic_download:
-                self.download_files('img', 'original', wrote_count)
-            if self.original_video_download:
-                self.download_files('video', 'original', wrote_count)
-            if not self.filter:
-                if self.retweet_pic_download:
-                    self.download_files('img', 'retweet', wrote_count)
-                if self.retweet_video_download:
-                    self.download_files('video', 'retweet', wrote_count)
+    def is_long_timeline(self):
+        """微博数超过10万的用户改用紧凑的id集合，减少内存占用"""
+        return self.user.get('statuses_count', 0) > 100000
+
+    def get_post_index(self):
+        """获取用户已爬取微博的索引，关键词搜索或强制全量爬取时不使用索引"""
+        if self.query or self.full_crawl:
+            return None
+        file_path = os.path.split(os.path.realpath(
+            __file__))[0] + os.sep + 'weibo' + os.sep + '.index' + os.sep + str(
+                self.user_config['user_id']) + '.txt'
+        return PostIndex(file_path, compact=self.is_long_timeline())
+
+    def get_sinks(self):
+        """返回各写入方式的名称和写入一批微博的函数，每个在后台有自己的队列和线程"""
+        sinks = []
+        if 'csv' in self.write_mode:
+            sinks.append(('csv', self.write_csv))
+        if 'json' in self.write_mode:
+            sinks.append(('json', self.write_json))
+        if 'jsonl' in self.write_mode:
+            sinks.append(('jsonl', self.write_jsonl))
+        if 'mysql' in self.write_mode:
+            sinks.append(('mysql', self.weibo_to_mysql))
+        if 'mongo' in self.write_mode:
+            sinks.append(('mongo', self.weibo_to_mongodb))
+        download = self.original_pic_download or self.original_video_download
+        if not self.filter:
+            download = (download or self.retweet_pic_download
+                        or self.retweet_video_download)
+        if download:
+            sinks.append(('download', self.download_weibo_files))
+        return sinks
+
+    def download_weibo_files(self, weibo_list):
+        """下载一批微博中的图片和视频"""
+        if self.original_pic_download:
+            self.download_files('img', 'original', weibo_list)
+        if self.original_video_download:
+            self.download_files('video', 'original', weibo_list)
+        if not self.filter:
+            if self.retweet_pic_download:
+                self.download_files('img', 'retweet', weibo_list)
+            if self.retweet_video_download:
+                self.download_files('video', 'retweet', weibo_list)
+
+    def get_sink_stage(self):
+        """为当前用户启动各写入方式的后台线程，每批微博全部写完后加入已爬取索引"""
+        return SinkStage(self.get_sinks(),
+                         queue_size=self.sink_queue_size,
+                         retries=self.sink_retries,
+                         retry_log=self.get_filepath('retry'),
+                         on_done=self.weibo_written)
+
+    def close_sink_stage(self):
+        """等待已交出的微博全部写完，返回最终写入失败的次数"""
+        if self.sink_stage is None:
+            return 0
+        sink_stage, self.sink_stage = self.sink_stage, None
+        sink_stage.close()
+        return sink_stage.failed
+
+    def is_buffer_full(self):
+        """待写入的微博是否已达到buffer_count条或buffer_bytes字节"""
+        return (self.buffer_count and len(self.weibo) >= self.buffer_count) or (
+            self.buffer_bytes and self.weibo_bytes >= self.buffer_bytes)
+
+    def flush_weibo(self):
+        """把待写入的微博交给各写入方式，爬虫只保留它们的id，写完后即释放"""
+        if self.weibo:
+            batch = tuple(self.weibo)
+            self.weibo = []
+            self.weibo_bytes = 0
+            self.sink_stage.put(batch)
+
+    def weibo_written(self, weibo_list, ok):
+        """一批微博已由所有写入方式处理完，全部成功时加入已爬取索引，
+        有写入失败的微博不加入，下次运行时重新爬取
+        """
+        if ok and self.post_index is not None:
+            self.post_index.add(weibo_list)
 
     def get_pages(self):
         """获取全部微博"""
         try:
             self.get_user_info()
             self.print_user_info()
-            since_date = datetime.strptime(self.user_config['since_date'],
-                                           '%Y-%m-%d')
-            today = datetime.strptime(str(date.today()), '%Y-%m-%d')
-            if since_date <= today:
+            self.post_index = self.get_post_index()
+            # 发布时间和起始时间格式相同，每条微博直接按字符串比较
+            self.since_cutoff = parse_since_date(self.user_config['since_date'])
+            now = beijing_now()
+            if self.since_cutoff <= format_datetime(now):
                 page_count = self.get_page_count()
-                wrote_count = 0
-                page1 = 0
-                random_pages = random.randint(1, 5)
-                self.start_date = datetime.now().strftime('%Y-%m-%d')
+                self.page_count = page_count
+                self.start_date = now.strftime(START_DATE_FORMAT)
+                self.sink_stage = self.get_sink_stage()
                 pages = range(self.start_page, page_count + 1)
+                # 爬虫速度过快容易被系统限制(一段时间后限制会自动解除)，所有请求都经过
+                # rate_limiter，请求间隔带有随机抖动，被限制时自动降速并退避
+                reached_end = False
+                failed_pages = []
                 for page in tqdm(pages, desc='Progress'):
-                    is_end = self.get_one_page(page)
-                    if is_end:
+                    status = self.get_one_page(page)
+                    if status == PAGE_END:
+                        reached_end = True
                         break
+                    if status == PAGE_FAILED:
+                        failed_pages.append(page)
 
-                    if page % 20 == 0:  # 每爬20页写入一次文件
-                        self.write_data(wrote_count)
-                        wrote_count = self.got_count
-
-                    # 通过加入随机等待避免被限制。爬虫速度过快容易被系统限制(一段时间后限
-                    # 制会自动解除)，加入随机等待模拟人的操作，可降低被系统限制的风险。默
-                    # 认是每爬取1到5页随机等待6到10秒，如果仍然被限，可适当增加sleep时间
-                    if (page -
-                            page1) % random_pages == 0 and page < page_count:
-                        sleep(random.randint(6, 10))
-                        page1 = page
-                        random_pages = random.randint(1, 5)
-
-                self.write_data(wrote_count)  # 将剩余不足20页的微博写入文件
+                    # 待写入的微博达到buffer_count条或buffer_bytes字节时交给后台写入，
+                    # 爬虫继续爬取下一页，内存占用只取决于这两个值和队列长度
+                    if self.is_buffer_full():
+                        self.flush_weibo()
+                else:
+                    reached_end = True  # 已爬完最后一页
+
+                self.flush_weibo()  # 写入剩余的微博
+                failed = self.close_sink_stage()
+                # 只有从第一页连续爬到终点、没有失败的页和写入时，才把最新微博记为
+                # 已完整爬取，否则以后的增量爬取会跳过漏掉的微博
+                if failed_pages:
+                    logger.warning(u'第%s页获取失败，本次不记录为完整爬取',
+                                   ','.join(map(str, failed_pages)))
+                if failed:
+                    logger.warning(u'有%d批微博写入失败，本次不记录为完整爬取', failed)
+                if (reached_end and not failed_pages and not failed
+                        and self.post_index is not None
+                        and self.start_page == 1):
+                    self.post_index.complete()
             logger.info(u'微博爬取完成，共爬取%d条微博', self.got_count)
         except Exception as e:
             logger.exception(e)
+        finally:
+            self.close_sink_stage()
+            self.close_writers()
 
     def get_user_config_list(self, file_path):
         """获取文件中的微博id信息"""
@@ -1129,7 +1265,8 @@ class Weibo(object):
                         if self.is_date(info[2]):
                             user_config['since_date'] = info[2]
                         elif info[2].isdigit():
-                            since_date = date.today() - timedelta(int(info[2]))
+                            since_date = beijing_now().date() - timedelta(
+                                int(info[2]))
                             user_config['since_date'] = str(since_date)
                     else:
                         user_config['since_date'] = self.since_date
@@ -1144,29 +1281,63 @@ class Weibo(object):
     def initialize_info(self, user_config):
         """初始化爬虫信息"""
         self.weibo = []
+        self.weibo_bytes = 0
         self.user = {}
         self.user_config = user_config
         self.got_count = 0
-        self.weibo_id_list = []
+        self.page_count = 0
+        self.weibo_id_list = IdSet(compact=True)
+        self.post_index = None
+        self.jsonl_writer = None
+        self.csv_writer = None
+        self.sink_stage = None
+
+    def crawl_user(self, user_config):
+        """爬取一个用户的全部微博"""
+        if len(user_config['query_list']):
+            for query in user_config['query_list']:
+                self.query = query
+                self.initialize_info(user_config)
+                self.get_pages()
+        else:
+            self.query = ''
+            self.initialize_info(user_config)
+            self.get_pages()
+        logger.info(u'信息抓取完毕')
+        logger.info('*' * 100)
+        if self.user_config_file_path and self.user:
+            self.update_user_config_file(self.user_config_file_path)
+
+    def crawl_user_in_thread(self, user_config):
+        """在独立的爬虫副本中爬取一个用户，各用户的爬取状态互不影响
+
+        副本与原爬虫共用HTTP会话、下载线程池、限速器和锁，
+        用户信息、微博列表等状态由initialize_info在副本上重新创建
+        """
+        try:
+            copy.copy(self).crawl_user(user_config)
+        except Exception as e:
+            logger.exception(e)
 
     def start(self):
         """运行爬虫"""
         try:
-            for user_config in self.user_config_list:
-                if len(user_config['query_list']):
-                    for query in user_config['query_list']:
-                        self.query = query
-                        self.initialize_info(user_config)
-                        self.get_pages()
-                else:
-                    self.initialize_info(user_config)
-                    self.get_pages()
-                logger.info(u'信息抓取完毕')
-                logger.info('*' * 100)
-                if self.user_config_file_path and self.user:
-                    self.update_user_config_file(self.user_config_file_path)
+            if self.user_threads > 1:
+                with ThreadPoolExecutor(
+                        max_workers=self.user_threads) as executor:
+                    list(
+                        executor.map(self.crawl_user_in_thread,
+                                     self.user_config_list))
+            else:
+                for user_config in self.user_config_list:
+                    self.crawl_user(user_config)
         except Exception as e:
             logger.exception(e)
+        finally:
+            if self.mysql_sink is not None:
+                self.mysql_sink.close()
+            if self.mongo_sink is not None:
+                self.mongo_sink.close()
 
 
 def get_config():